@@ -7,6 +7,8 @@ Basado en:
 Este archivo centraliza todos los códigos para conversión automática.
 """
 
+from functools import lru_cache
+
 # =============================================================================
 # CATÁLOGO N° 03 - UNIDADES DE MEDIDA (UN/ECE Rec 20)
 # =============================================================================
@@ -137,6 +139,7 @@ CATALOGO_16_TIPO_PRECIO = {
 # FUNCIONES DE CONVERSIÓN
 # =============================================================================
 
+@lru_cache(maxsize=128)
 def convertir_unidad_medida(codigo_xml: str) -> str:
     """
     Convierte código de unidad de medida XML (UN/ECE) a nombre legible SUNAT.
@@ -149,6 +152,7 @@ def convertir_unidad_medida(codigo_xml: str) -> str:
     return CATALOGO_03_UNIDAD_MEDIDA.get(codigo_upper, codigo_upper)
 
 
+@lru_cache(maxsize=128)
 def convertir_moneda(codigo_xml: str) -> str:
     """
     Convierte código de moneda ISO 4217 a nombre legible.
@@ -13,12 +13,111 @@ SECCIÓN 5 - CUOTAS
 SIN VALORES HARDCODEADOS - Todo se extrae dinámicamente del texto OCR.
 """
 
+import logging
 import re
+import threading
+from bisect import bisect_right
 import easyocr
 import numpy as np
 from PIL import Image, ImageEnhance, ImageFilter
+try:
+    import cv2  # Viene con EasyOCR (opencv-python-headless)
+except ImportError:
+    cv2 = None
 from catalogos_sunat import convertir_unidad_medida, convertir_moneda
 
+# Trazas de depuración (activar con logging.basicConfig(level=logging.DEBUG))
+log = logging.getLogger(__name__)
+
+# =============================================================================
+# PATRONES REGEX (COMPILADOS UNA SOLA VEZ)
+# =============================================================================
+# Motor RE2 opcional (google-re2): autómata de tiempo lineal, inmune al
+# backtracking catastrófico con texto OCR degenerado
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+
+def _compilar(patron, flags=0):
+    """
+    Compila un patrón con RE2 si está instalado; si no, con re estándar.
+    Solo acepta IGNORECASE y DOTALL. Diferencias de RE2 frente a re:
+    - \w, \d y \s son solo ASCII: dígitos o espacios no ASCII del OCR (p. ej.
+      el espacio duro U+00A0) no cuentan en _RE_NUMERO, _RE_MONTO_DECIMAL ni
+      en la clase [A-Z\s] de _RE_RAZON_RECEPTOR;
+    - $ (sin MULTILINE) solo coincide al final exacto del texto, no antes de
+      un '\n' final como en re.
+    Los patrones que dependen de \w Unicode o de ese $ siguen usando re.
+    """
+    if re2 is None:
+        return re.compile(patron, flags)
+    opciones = re2.Options()
+    opciones.case_sensitive = not (flags & re.IGNORECASE)
+    opciones.dot_nl = bool(flags & re.DOTALL)
+    return re2.compile(patron, opciones)
+
+
+# Montos
+_RE_MONTO_DECIMAL = _compilar(r'[\d.,]+\.\d{2}')
+_RE_NUMERO = _compilar(r'[\d.,]+')
+
+# Patrones que recorren TODO el texto OCR. Los de etiquetas se aplican sobre
+# el texto en minúsculas (ver _minusculas): sin IGNORECASE el motor puede
+# usar su búsqueda rápida de literales.
+_RE_RAZON_RECEPTOR = _compilar(r'(?:Se.or\(?es\)?\s*:?\s*)?([A-Z][A-Z\s]+(?:SOCIEDAD|S\.?A\.?C?\.?|E\.?I\.?R\.?L\.?|CERRADA|ABIERTA)[A-Z\s]*)')
+# Estos dos terminan en $: con re, no con RE2 (ver _compilar)
+_RE_OBSERVACION = re.compile(r'observaci[oó]n\s*:?\s*(.+?)(?:cantidad|$)', re.DOTALL)
+_RE_SON = re.compile(r'son:\s*(.+?)(?:soles|$)')
+_RE_TOTAL_CUOTAS = _compilar(r'total de cuotas\s*:?\s*(\d+)')
+
+# Campos de cabecera en un solo barrido del texto original: cada alternativa
+# tiene un único grupo con nombre (m.lastgroup indica el campo). Las etiquetas
+# ignoran mayúsculas con (?i:...); RUC y número de factura no. En la moneda
+# basta saber si contiene DOLAR, así que el \w solo ASCII de RE2 no afecta.
+_RE_CABECERA = _compilar(
+    r'RUC[:\s]*(?P<ruc>\d{11})'
+    r'|(?P<factura>[EF]\d{3}-?\d+)'
+    r'|(?i:fecha de emisi[oó]n)\s*:?\s*(?P<fecha_emision>\d{2}/\d{2}/\d{4})'
+    r'|(?i:forma de pago)\s*:?\s*(?P<forma_pago>(?i:contado|cr[eé]dito))'
+    r'|(?i:tipo de moneda)\s*:?\s*(?P<moneda>\w+)'
+    r'|(?P<fecha>\d{2}/\d{2}/\d{4})'
+)
+_CAMPOS_CABECERA = frozenset(('factura', 'fecha_emision', 'forma_pago', 'moneda'))
+
+# Patrones del recorrido único de líneas (cabecera, receptor y líneas de factura)
+_RE_ONCE_DIGITOS = re.compile(r'\d{11}')
+_RE_RAZON_EMISOR = re.compile(r'^([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ\s]+)\s+RUC')
+_RE_INICIO_MAYUSCULA = re.compile(r'^[A-ZÁÉÍÓÚÑ]')
+_RE_DIRECCION_EMISOR = re.compile(r'(Ayacucho|Av\.|Jr\.|Cal\.|Calle)\s+\d+', re.IGNORECASE)
+_RE_DIRECCION_EMISOR_TEXTO = re.compile(r'((?:Ayacucho|Av\.|Jr\.|Cal\.|Calle)[^R]+)', re.IGNORECASE)
+_RE_UBICACION = re.compile(r'(\w+)\s*[-]\s*([A-Z]+)\s*[-]\s*([A-Z]+)')
+_RE_ANTES_DIRECCION = re.compile(r'^(AV\.?[^D]+)', re.IGNORECASE)
+_RE_DESPUES_FACTURA = re.compile(r'factura\s+(.+?)$', re.IGNORECASE)
+_RE_DESPUES_CLIENTE = re.compile(r'Cliente\s+(.+?)(?:Tipo|$)', re.IGNORECASE)
+# Filtro previo de una sola pasada por línea: el patrón de ítem exige una de
+# estas unidades, así que sin coincidencia aquí no se intenta el patrón completo
+_RE_UNIDADES_ITEM = _compilar(r'unidad|niu|zz|und', re.IGNORECASE)
+_RE_LINEA_ITEM = re.compile(r'(\d+\.?\d*)\s*(UNIDAD|NIU|ZZ|UND)\s+(.+?)\s+(\d[\d,]*\.?\d*)\s*$', re.IGNORECASE)
+_RE_NO_CONTINUACION = re.compile(r'^(\d|Valor|Sub|SON|IGV|Importe|Gratuitas)', re.IGNORECASE)
+
+# Etiquetas de totales y cuotas para extraer_monto_inteligente: ya en
+# minúsculas, como las líneas de indexar_montos, así que van sin IGNORECASE
+_RE_ETIQUETA_GRATUITAS = re.compile('gratuitas')
+_RE_ETIQUETA_SUBTOTAL = re.compile(r'sub\s*total\s*ventas?')
+_RE_ETIQUETA_ANTICIPO = re.compile(r'anticipos?')
+_RE_ETIQUETA_DESCUENTO = re.compile(r'descuentos?')
+_RE_ETIQUETA_VALOR_VENTA = re.compile(r'valor\s*venta')
+_RE_ETIQUETA_ISC = re.compile(r'isc(?:\s|$)')
+_RE_ETIQUETA_IGV = re.compile('igv')
+_RE_ETIQUETA_OTROS_CARGOS = re.compile(r'otros?\s*cargos?')
+_RE_ETIQUETA_OTROS_TRIBUTOS = re.compile(r'otros?\s*tributos?')
+_RE_ETIQUETA_REDONDEO = re.compile('redondeo')
+_RE_ETIQUETA_IMPORTE_TOTAL = re.compile(r'importe\s*total')
+_RE_ETIQUETA_PENDIENTE = re.compile('pendiente de pago')
+
+
 # =============================================================================
 # SINGLETON EASYOCR READER
 # =============================================================================
@@ -28,7 +127,7 @@ def get_reader():
     """Obtiene el reader de EasyOCR (singleton para eficiencia)"""
     global _reader
     if _reader is None:
-        print("[OCR] Inicializando EasyOCR...")
+        log.debug("[OCR] Inicializando EasyOCR...")
         _reader = easyocr.Reader(['es'], gpu=False)
     return _reader
 
@@ -37,14 +136,55 @@ def get_reader():
 # PREPROCESAMIENTO DE IMAGEN
 # =============================================================================
 
+# Núcleo 3x3 de ImageFilter.SMOOTH (base de ImageEnhance.Sharpness)
+_KERNEL_SUAVIZADO = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+
+# Buffers reutilizables por hilo (evitan reservar una imagen completa por factura)
+_buffers = threading.local()
+
+
+def _buffer(nombre, shape):
+    """Devuelve un arreglo uint8 del hilo actual con la forma pedida."""
+    arr = getattr(_buffers, nombre, None)
+    if arr is None or arr.shape != shape:
+        arr = np.empty(shape, dtype=np.uint8)
+        setattr(_buffers, nombre, arr)
+    return arr
+
+
+def _realzar_arreglo(img):
+    """
+    Contraste x1.5 y nitidez x2.0 sobre un arreglo uint8 RGB, con las mismas
+    fórmulas que ImageEnhance (mezcla con el gris medio y con SMOOTH).
+    Modifica `img` en el sitio; el suavizado usa el buffer del hilo.
+    """
+    # Aumentar contraste: 1.5*img - 0.5*media
+    gris = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY, dst=_buffer('gris', img.shape[:2]))
+    media = int(gris.mean() + 0.5)
+    cv2.addWeighted(img, 1.5, img, 0, -0.5 * media, dst=img)
+    
+    # Aumentar nitidez: 2*img - suavizado
+    suavizado = cv2.filter2D(img, -1, _KERNEL_SUAVIZADO, dst=_buffer('suavizado', img.shape))
+    cv2.addWeighted(img, 2.0, suavizado, -1.0, 0, dst=img)
+    return img
+
+
 def preprocesar_imagen(ruta_imagen):
     """
     Preprocesa la imagen para mejorar la precisión del OCR.
     - Aumenta contraste
-    - Convierte a escala de grises
     - Aplica nitidez
+    Decodifica con OpenCV (convertido a RGB, el orden que espera EasyOCR) y usa
+    PIL solo si OpenCV no está disponible o no reconoce el formato.
     """
     try:
+        if cv2 is not None:
+            img = cv2.imread(ruta_imagen, cv2.IMREAD_COLOR)
+            if img is not None:
+                cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=img)
+                return _realzar_arreglo(img)
+        
         img = Image.open(ruta_imagen)
         
         # Convertir a RGB si es necesario
@@ -69,16 +209,47 @@ def preprocesar_imagen(ruta_imagen):
 # FUNCIONES DE UTILIDAD
 # =============================================================================
 
+def _minusculas(texto):
+    """
+    Pasa el texto a minúsculas conservando la longitud ('İ' es el único
+    carácter que crece al bajarlo), así los offsets de un match sobre el
+    texto en minúsculas sirven para recortar el texto original.
+    """
+    return texto.replace('İ', 'i').lower()
+
+
+class _TablaLimpieza(dict):
+    """
+    Tabla para str.translate: conserva letras, dígitos, '_', espacios y la
+    puntuación válida; elimina el resto. Se llena bajo demanda, así cada
+    carácter se clasifica una sola vez por proceso.
+    """
+    _PUNTUACION = frozenset('-/.,;:°()')
+
+    def __missing__(self, codigo):
+        c = chr(codigo)
+        valor = codigo if (c.isalnum() or c == '_' or c.isspace() or c in self._PUNTUACION) else None
+        self[codigo] = valor
+        return valor
+
+
+_TABLA_LIMPIEZA = _TablaLimpieza()
+
+
 def limpiar_texto(texto):
     """Limpia caracteres basura del OCR"""
     if not texto:
         return ""
-    # Mantener caracteres válidos
-    texto = re.sub(r'[^\w\s\-/.,;:°áéíóúñÁÉÍÓÚÑ()]', '', texto)
+    # Mantener caracteres válidos (una sola pasada en C con str.translate)
+    texto = texto.translate(_TABLA_LIMPIEZA)
     texto = re.sub(r'\s+', ' ', texto).strip()
     return texto
 
 
+# Tabla de limpiar_moneda: quita espacios y corrige O/o leídos en lugar de 0
+_TABLA_MONEDA = str.maketrans({' ': None, 'O': '0', 'o': '0'})
+
+
 def limpiar_moneda(valor_str):
     """
     Convierte string de moneda a float con manejo inteligente de errores OCR.
@@ -96,11 +267,8 @@ def limpiar_moneda(valor_str):
     valor_str = re.sub(r'^S/?I?\s*', '', valor_str, flags=re.IGNORECASE)
     valor_str = re.sub(r'^\$\s*', '', valor_str)
     
-    # 2. Quitar espacios
-    valor_str = valor_str.replace(' ', '')
-    
-    # 3. Reemplazar O/o por 0 (error común OCR)
-    valor_str = re.sub(r'[Oo]', '0', valor_str)
+    # 2. Quitar espacios y 3. reemplazar O/o por 0 (error común OCR)
+    valor_str = valor_str.translate(_TABLA_MONEDA)
     
     # 4. Detectar formato y normalizar
     # Caso: "5.200.00" o "55.200.00" (punto como separador miles)
@@ -165,6 +333,30 @@ def extraer_texto_easyocr(ruta_imagen):
     return texto_completo, lineas, resultados_ordenados
 
 
+def _unir_direccion(linea, patron_despues):
+    """
+    Une la parte de dirección antes de la etiqueta (AV...) con la que sigue
+    a la etiqueta según `patron_despues`.
+    """
+    parte1 = ""
+    match_antes = _RE_ANTES_DIRECCION.search(linea)
+    if match_antes:
+        parte1 = match_antes.group(1).strip()
+    
+    parte2 = ""
+    match_despues = patron_despues.search(linea)
+    if match_despues:
+        parte2 = match_despues.group(1).strip()
+    
+    # Combinar
+    if parte1 and parte2:
+        direccion = f"{parte1} {parte2}"
+    else:
+        direccion = parte1 or parte2
+    
+    return limpiar_texto(direccion)
+
+
 def buscar_valor_despues_de(texto, etiqueta, tipo='texto'):
     """
     Busca un valor después de una etiqueta.
@@ -188,24 +380,51 @@ def buscar_valor_despues_de(texto, etiqueta, tipo='texto'):
     return None
 
 
-def extraer_monto_inteligente(texto, etiqueta):
+def indexar_montos(texto):
+    """
+    Recorre el texto UNA sola vez y asocia a cada línea el último monto con
+    decimales que contiene, para no repetir el findall por cada etiqueta.
+    Retorna: lista de (linea_en_minusculas, ultimo_monto_decimal o None)
+    """
+    lineas = _minusculas(texto).split('\n')
+    
+    # Posición de inicio de cada línea dentro del texto
+    inicios = []
+    pos = 0
+    for linea in lineas:
+        inicios.append(pos)
+        pos += len(linea) + 1
+    
+    # Los montos no cruzan saltos de línea: el último de cada línea gana
+    ultimos = [None] * len(lineas)
+    for match in _RE_MONTO_DECIMAL.finditer(texto):
+        ultimos[bisect_right(inicios, match.start()) - 1] = match.group()
+    
+    return list(zip(lineas, ultimos))
+
+
+def extraer_monto_inteligente(texto, etiqueta, indice=None):
     """
     Extrae un monto de forma inteligente manejando errores comunes del OCR.
     El OCR puede leer "S/ 5,200.00" como "51 5.200.00" o "55.200.00"
+    etiqueta: patrón compilado que coincide en minúsculas (las líneas del
+    índice ya lo están), o cadena, que se busca sin distinguir mayúsculas.
+    indice: resultado de indexar_montos(texto), para reutilizarlo entre etiquetas.
     """
+    if indice is None:
+        indice = indexar_montos(texto)
+    if isinstance(etiqueta, str):
+        etiqueta = re.compile(etiqueta, re.IGNORECASE)
+    
     # Buscar la línea que contiene la etiqueta
-    lineas = texto.split('\n')
-    for linea in lineas:
-        if re.search(etiqueta, linea, re.IGNORECASE):
-            # Extraer todos los números con decimales de la línea
-            numeros = re.findall(r'[\d.,]+\.[\d]{2}', linea)
-            
-            if numeros:
-                # Tomar el último número (generalmente es el valor)
-                return limpiar_moneda(numeros[-1])
+    for linea, ultimo_decimal in indice:
+        if etiqueta.search(linea):
+            # Tomar el último número con decimales (generalmente es el valor)
+            if ultimo_decimal:
+                return limpiar_moneda(ultimo_decimal)
             
             # Si no hay con decimales, buscar cualquier número
-            numeros = re.findall(r'[\d.,]+', linea)
+            numeros = _RE_NUMERO.findall(linea)
             if numeros:
                 return limpiar_moneda(numeros[-1])
     
@@ -227,240 +446,215 @@ def procesar_factura_img(ruta_archivo):
         # Extraer texto con EasyOCR
         texto_completo, lineas, resultados_raw = extraer_texto_easyocr(ruta_archivo)
         
-        # Debug: mostrar texto extraído
-        print("=" * 60)
-        print("TEXTO EXTRAIDO POR EASYOCR:")
-        print("=" * 60)
-        for i, linea in enumerate(lineas):
-            print(f"[{i:02d}] {linea}")
-        print("=" * 60)
+        # Debug: mostrar texto extraído (sin formatear si DEBUG está apagado)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("=" * 60)
+            log.debug("TEXTO EXTRAIDO POR EASYOCR:")
+            log.debug("=" * 60)
+            for i, linea in enumerate(lineas):
+                log.debug("[%02d] %s", i, linea)
+            log.debug("=" * 60)
         
         if not lineas:
             return {"validacion": ["No se pudo extraer texto de la imagen"]}
         
+        # Texto en minúsculas (misma longitud) para las búsquedas por etiqueta
+        texto_lc = _minusculas(texto_completo)
+        
+        # =====================================================================
+        # BARRIDO ÚNICO DE CABECERA
+        # =====================================================================
+        # RUCs, número de factura, fechas, forma de pago y moneda en una sola
+        # pasada; se corta en cuanto están todos los campos y dos RUC distintos.
+        campos_cabecera = {}
+        todos_rucs = []
+        for match in _RE_CABECERA.finditer(texto_completo):
+            campo = match.lastgroup
+            if campo == 'ruc':
+                ruc = int(match.group('ruc'))
+                if ruc not in todos_rucs:
+                    todos_rucs.append(ruc)
+            elif campo not in campos_cabecera:
+                campos_cabecera[campo] = match.group(campo)
+            
+            if len(todos_rucs) > 1 and _CAMPOS_CABECERA.issubset(campos_cabecera):
+                break
+        
+        # =====================================================================
+        # RECORRIDO ÚNICO DE LÍNEAS
+        # =====================================================================
+        # Una sola pasada sobre `lineas` para todos los campos que se buscan
+        # línea por línea; cada campo deja de evaluarse una vez encontrado.
+        razon_social_emisor = ""
+        razon_emisor_buscada = False
+        direccion_emisor = ""
+        distrito, provincia, departamento = "", "", ""
+        razon_social_receptor = ""
+        direccion_receptor = ""
+        direccion_cliente = ""
+        coincidencias_items = []
+        
+        for i, linea in enumerate(lineas):
+            # RAZÓN SOCIAL EMISOR - Primera línea con RUC dentro de las 5 primeras
+            if not razon_emisor_buscada and i < 5 and 'RUC' in linea and _RE_ONCE_DIGITOS.search(linea):
+                razon_emisor_buscada = True
+                # La razón social está antes del RUC en la misma línea o línea anterior
+                match = _RE_RAZON_EMISOR.search(linea)
+                if match:
+                    razon_social_emisor = match.group(1).strip()
+                elif i > 0 and _RE_INICIO_MAYUSCULA.match(lineas[i-1]):
+                    razon_social_emisor = limpiar_texto(lineas[i-1])
+            
+            if i < 3:
+                # DIRECCIÓN EMISOR - Dirección típica (Ayacucho, Av., Jr., Cal., etc.)
+                if not direccion_emisor and _RE_DIRECCION_EMISOR.search(linea):
+                    match = _RE_DIRECCION_EMISOR_TEXTO.search(linea)
+                    if match:
+                        direccion_emisor = limpiar_texto(match.group(1))
+                
+                # UBICACIÓN GEOGRÁFICA - Patrón XXX-XXX-XXX
+                if not distrito:
+                    geo_match = _RE_UBICACION.search(linea)
+                    if geo_match:
+                        distrito = geo_match.group(1).strip()
+                        provincia = geo_match.group(2).strip()
+                        departamento = geo_match.group(3).strip()
+            
+            # RAZÓN SOCIAL RECEPTOR - Después de "Señor(es)", en esta línea o la siguiente
+            if not razon_social_receptor and 'Se' in linea and 'or' in linea:
+                texto_buscar = linea
+                if i + 1 < len(lineas):
+                    texto_buscar += ' ' + lineas[i + 1]
+                match = _RE_RAZON_RECEPTOR.search(texto_buscar)
+                if match:
+                    razon_social_receptor = limpiar_texto(match.group(1))
+            
+            # DIRECCIÓN RECEPTOR DE LA FACTURA (prevalece la última coincidencia)
+            if 'Receptor' in linea and 'factura' in linea:
+                # Estructura: "AV... Dirección del Receptor de la factura CRUCE DE..."
+                direccion_receptor = _unir_direccion(linea, _RE_DESPUES_FACTURA)
+            
+            # DIRECCIÓN CLIENTE (prevalece la última coincidencia)
+            if 'Cliente' in linea and 'Direcci' in linea:
+                direccion_cliente = _unir_direccion(linea, _RE_DESPUES_CLIENTE)
+            
+            # LÍNEA DE FACTURA - número UNIDAD/NIU texto número
+            if _RE_UNIDADES_ITEM.search(linea):
+                match = _RE_LINEA_ITEM.search(linea)
+                if match:
+                    coincidencias_items.append((i, match))
+        
         # =====================================================================
         # SECCIÓN 1: CABECERA (EMISOR)
         # =====================================================================
-        print("\n[SECCION 1] Procesando CABECERA (EMISOR)...")
+        log.debug("\n[SECCION 1] Procesando CABECERA (EMISOR)...")
         
         # RUC EMISOR - Buscar primer RUC de 11 dígitos (formato 10xxx o 20xxx)
         ruc_emisor = 0
-        match_ruc = re.search(r'RUC[:\s]*(\d{11})', texto_completo)
-        if match_ruc:
-            ruc_emisor = int(match_ruc.group(1))
-            print(f"    RUC Emisor: {ruc_emisor}")
+        if todos_rucs:
+            ruc_emisor = todos_rucs[0]
+            log.debug("    RUC Emisor: %s", ruc_emisor)
         else:
             validaciones.append("SECCION 1: No se encontro RUC del emisor")
         
-        # RAZÓN SOCIAL EMISOR - Buscar nombre completo antes del RUC
-        razon_social_emisor = ""
-        for i, linea in enumerate(lineas[:5]):
-            # Buscar línea que contiene RUC
-            if 'RUC' in linea and re.search(r'\d{11}', linea):
-                # La razón social está antes del RUC en la misma línea o línea anterior
-                match = re.search(r'^([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑ\s]+)\s+RUC', linea)
-                if match:
-                    razon_social_emisor = match.group(1).strip()
-                elif i > 0:
-                    # Buscar en línea anterior
-                    linea_ant = lineas[i-1]
-                    if re.match(r'^[A-ZÁÉÍÓÚÑ]', linea_ant):
-                        razon_social_emisor = limpiar_texto(linea_ant)
-                print(f"    Razon Social Emisor: {razon_social_emisor}")
-                break
+        # RAZÓN SOCIAL EMISOR - Obtenida en el recorrido único de líneas
+        if razon_emisor_buscada:
+            log.debug("    Razon Social Emisor: %s", razon_social_emisor)
         
         # NÚMERO DE FACTURA - Formato E001-XXX o F001-XXX
         numero_factura = ""
-        match_factura = re.search(r'([EF]\d{3}[-]?\d+)', texto_completo)
-        if match_factura:
-            numero_factura = match_factura.group(1)
+        if 'factura' in campos_cabecera:
+            numero_factura = campos_cabecera['factura']
             if '-' not in numero_factura:
                 numero_factura = numero_factura[:4] + '-' + numero_factura[4:]
-            print(f"    Numero Factura: {numero_factura}")
+            log.debug("    Numero Factura: %s", numero_factura)
         
-        # DIRECCIÓN EMISOR - Buscar en primeras líneas
-        direccion_emisor = ""
-        for linea in lineas[:3]:
-            # Buscar dirección típica (Ayacucho, Av., Jr., Cal., etc.)
-            if re.search(r'(Ayacucho|Av\.|Jr\.|Cal\.|Calle)\s+\d+', linea, re.IGNORECASE):
-                # Extraer parte de dirección
-                match = re.search(r'((?:Ayacucho|Av\.|Jr\.|Cal\.|Calle)[^R]+)', linea, re.IGNORECASE)
-                if match:
-                    direccion_emisor = limpiar_texto(match.group(1))
-                    print(f"    Direccion Emisor: {direccion_emisor}")
-                    break
-        
-        # UBICACIÓN GEOGRÁFICA - Buscar patrón XXX-XXX-XXX o XXX XXX XXX
-        distrito, provincia, departamento = "", "", ""
-        # Buscar en la cabecera el patrón de ubicación
-        for linea in lineas[:3]:
-            geo_match = re.search(r'(\w+)\s*[-]\s*([A-Z]+)\s*[-]\s*([A-Z]+)', linea)
-            if geo_match:
-                distrito = geo_match.group(1).strip()
-                provincia = geo_match.group(2).strip()
-                departamento = geo_match.group(3).strip()
-                print(f"    Ubicacion: {distrito} - {provincia} - {departamento}")
-                break
+        # DIRECCIÓN EMISOR Y UBICACIÓN - Obtenidas en el recorrido único de líneas
+        if direccion_emisor:
+            log.debug("    Direccion Emisor: %s", direccion_emisor)
+        if distrito:
+            log.debug("    Ubicacion: %s - %s - %s", distrito, provincia, departamento)
         
         # =====================================================================
         # SECCIÓN 2: RECEPTOR Y OPERACIÓN
         # =====================================================================
-        print("\n[SECCION 2] Procesando RECEPTOR Y OPERACION...")
+        log.debug("\n[SECCION 2] Procesando RECEPTOR Y OPERACION...")
         
         # FECHA DE EMISIÓN
-        fecha_emision = ""
-        match_fecha = re.search(r'Fecha de Emisi[oó]n\s*:?\s*(\d{2}/\d{2}/\d{4})', texto_completo, re.IGNORECASE)
-        if match_fecha:
-            fecha_emision = match_fecha.group(1)
-        else:
-            # Buscar cualquier fecha en formato DD/MM/YYYY
-            match_fecha = re.search(r'(\d{2}/\d{2}/\d{4})', texto_completo)
-            if match_fecha:
-                fecha_emision = match_fecha.group(1)
-        print(f"    Fecha Emision: {fecha_emision}")
+        # Si no hay etiqueta, usar la primera fecha en formato DD/MM/YYYY
+        fecha_emision = campos_cabecera.get('fecha_emision') or campos_cabecera.get('fecha', "")
+        log.debug("    Fecha Emision: %s", fecha_emision)
         
         # FORMA DE PAGO - Buscar explícitamente "Contado" o "Crédito"
         forma_pago = "Contado"  # Default
-        # Buscar en la línea que contiene "Forma de pago"
-        match_forma = re.search(r'Forma de pago\s*:?\s*(Contado|Cr[eé]dito)', texto_completo, re.IGNORECASE)
-        if match_forma:
-            forma_pago = match_forma.group(1).capitalize()
+        if 'forma_pago' in campos_cabecera:
+            forma_pago = campos_cabecera['forma_pago'].capitalize()
             if 'cre' in forma_pago.lower() or 'cré' in forma_pago.lower():
                 forma_pago = "Credito"
             else:
                 forma_pago = "Contado"
-        print(f"    Forma de Pago: {forma_pago}")
+        log.debug("    Forma de Pago: %s", forma_pago)
         
         # RUC RECEPTOR - Buscar segundo RUC diferente al emisor
         ruc_receptor = 0
-        todos_rucs = re.findall(r'RUC\s*:?\s*(\d{11})', texto_completo)
-        for ruc in todos_rucs:
-            ruc_int = int(ruc)
-            if ruc_int != ruc_emisor:
-                ruc_receptor = ruc_int
-                print(f"    RUC Receptor: {ruc_receptor}")
-                break
-        
-        # RAZÓN SOCIAL RECEPTOR - Buscar después de "Señor(es)"
-        razon_social_receptor = ""
-        for i, linea in enumerate(lineas):
-            if 'Se' in linea and 'or' in linea:  # Señor(es)
-                # La razón social puede estar en esta línea o la siguiente
-                texto_buscar = linea
-                if i + 1 < len(lineas):
-                    texto_buscar += ' ' + lineas[i + 1]
-                
-                # Buscar nombre de empresa (MAYUSCULAS, palabras como SOCIEDAD, S.A.C., etc.)
-                match = re.search(r'(?:Se.or\(?es\)?\s*:?\s*)?([A-Z][A-Z\s]+(?:SOCIEDAD|S\.?A\.?C?\.?|E\.?I\.?R\.?L\.?|CERRADA|ABIERTA)[A-Z\s]*)', texto_buscar)
-                if match:
-                    razon_social_receptor = limpiar_texto(match.group(1))
-                    print(f"    Razon Social Receptor: {razon_social_receptor}")
-                    break
-        
-        # DIRECCIONES - Estrategia mejorada
-        direccion_receptor = ""
-        direccion_cliente = ""
-        
-        # Buscar líneas que contienen las direcciones
-        for i, linea in enumerate(lineas):
-            # DIRECCIÓN RECEPTOR DE LA FACTURA
-            if 'Receptor' in linea and 'factura' in linea:
-                # Estructura: "AV... Dirección del Receptor de la factura CRUCE DE..."
-                # Parte 1: antes de "Dirección del Receptor"
-                parte1 = ""
-                match_antes = re.search(r'^(AV\.?[^D]+)', linea, re.IGNORECASE)
-                if match_antes:
-                    parte1 = match_antes.group(1).strip()
-                
-                # Parte 2: después de "factura"
-                parte2 = ""
-                match_despues = re.search(r'factura\s+(.+?)$', linea, re.IGNORECASE)
-                if match_despues:
-                    parte2 = match_despues.group(1).strip()
-                
-                # Combinar
-                if parte1 and parte2:
-                    direccion_receptor = f"{parte1} {parte2}"
-                elif parte1:
-                    direccion_receptor = parte1
-                elif parte2:
-                    direccion_receptor = parte2
-                
-                direccion_receptor = limpiar_texto(direccion_receptor)
-                print(f"    Direccion Receptor: {direccion_receptor}")
-            
-            # DIRECCIÓN CLIENTE
-            if 'Cliente' in linea and 'Direcci' in linea:
-                # Estructura similar
-                parte1 = ""
-                match_antes = re.search(r'^(AV\.?[^D]+)', linea, re.IGNORECASE)
-                if match_antes:
-                    parte1 = match_antes.group(1).strip()
-                
-                parte2 = ""
-                match_despues = re.search(r'Cliente\s+(.+?)(?:Tipo|$)', linea, re.IGNORECASE)
-                if match_despues:
-                    parte2 = match_despues.group(1).strip()
-                
-                if parte1 and parte2:
-                    direccion_cliente = f"{parte1} {parte2}"
-                elif parte1:
-                    direccion_cliente = parte1
-                elif parte2:
-                    direccion_cliente = parte2
-                
-                direccion_cliente = limpiar_texto(direccion_cliente)
-                print(f"    Direccion Cliente: {direccion_cliente}")
+        if len(todos_rucs) > 1:
+            ruc_receptor = todos_rucs[1]
+            log.debug("    RUC Receptor: %s", ruc_receptor)
+        
+        # RAZÓN SOCIAL RECEPTOR Y DIRECCIONES - Obtenidas en el recorrido único de líneas
+        if razon_social_receptor:
+            log.debug("    Razon Social Receptor: %s", razon_social_receptor)
+        if direccion_receptor:
+            log.debug("    Direccion Receptor: %s", direccion_receptor)
+        if direccion_cliente:
+            log.debug("    Direccion Cliente: %s", direccion_cliente)
         
         # TIPO DE MONEDA
         tipo_moneda = "SOLES"
-        match_moneda = re.search(r'Tipo de Moneda\s*:?\s*(\w+)', texto_completo, re.IGNORECASE)
-        if match_moneda:
-            moneda = match_moneda.group(1).upper()
+        if 'moneda' in campos_cabecera:
+            moneda = campos_cabecera['moneda'].upper()
             if 'DOLAR' in moneda:
                 tipo_moneda = "DOLARES"
-        print(f"    Tipo Moneda: {tipo_moneda}")
+        log.debug("    Tipo Moneda: %s", tipo_moneda)
         
         # OBSERVACIÓN
         observacion = ""
-        match_obs = re.search(r'Observaci[oó]n\s*:?\s*(.+?)(?:Cantidad|$)', texto_completo, re.IGNORECASE | re.DOTALL)
+        match_obs = _RE_OBSERVACION.search(texto_lc)
         if match_obs:
-            observacion = limpiar_texto(match_obs.group(1))[:150]
-            print(f"    Observacion: {observacion}")
+            # Recortar del texto original para conservar mayúsculas
+            observacion = limpiar_texto(texto_completo[match_obs.start(1):match_obs.end(1)])[:150]
+            log.debug("    Observacion: %s", observacion)
         
         # =====================================================================
         # SECCIÓN 3: LÍNEAS DE FACTURA
         # =====================================================================
-        print("\n[SECCION 3] Procesando LINEAS DE FACTURA...")
+        log.debug("\n[SECCION 3] Procesando LINEAS DE FACTURA...")
         lista_lineas = []
         
-        # Buscar patrón: cantidad UNIDAD descripción valorUnitario
-        for i, linea in enumerate(lineas):
-            # Patrón flexible: número UNIDAD/NIU texto número
-            match = re.search(r'(\d+\.?\d*)\s*(UNIDAD|NIU|ZZ|UND)\s+(.+?)\s+(\d[\d,]*\.?\d*)\s*$', linea, re.IGNORECASE)
-            if match:
-                cantidad = float(match.group(1))
-                unidad = match.group(2).upper()
-                descripcion = limpiar_texto(match.group(3))
-                valor_str = match.group(4)
-                valor_unitario = limpiar_moneda(valor_str)
-                
-                # Buscar continuación de descripción en línea siguiente
-                if i + 1 < len(lineas):
-                    sig_linea = lineas[i + 1]
-                    # Si no empieza con número ni palabra clave de totales
-                    if not re.match(r'^(\d|Valor|Sub|SON|IGV|Importe|Gratuitas)', sig_linea, re.IGNORECASE):
-                        descripcion += ' ' + limpiar_texto(sig_linea)
-                
-                print(f"    Linea: cant={cantidad}, unidad={unidad}, valor={valor_unitario}")
-                print(f"           desc={descripcion[:50]}...")
-                
-                lista_lineas.append({
-                    "cantidad": cantidad,
-                    "unidadMedida": convertir_unidad_medida(unidad),
-                    "descripcion": descripcion,
-                    "valorUnitario": valor_unitario
-                })
+        # Coincidencias (cantidad UNIDAD descripción valorUnitario) del recorrido único
+        for i, match in coincidencias_items:
+            cantidad = float(match.group(1))
+            unidad = match.group(2).upper()
+            descripcion = limpiar_texto(match.group(3))
+            valor_str = match.group(4)
+            valor_unitario = limpiar_moneda(valor_str)
+            
+            # Buscar continuación de descripción en línea siguiente
+            if i + 1 < len(lineas):
+                sig_linea = lineas[i + 1]
+                # Si no empieza con número ni palabra clave de totales
+                if not _RE_NO_CONTINUACION.match(sig_linea):
+                    descripcion += ' ' + limpiar_texto(sig_linea)
+            
+            log.debug("    Linea: cant=%s, unidad=%s, valor=%s", cantidad, unidad, valor_unitario)
+            log.debug("           desc=%s...", descripcion[:50])
+            
+            lista_lineas.append({
+                "cantidad": cantidad,
+                "unidadMedida": convertir_unidad_medida(unidad),
+                "descripcion": descripcion,
+                "valorUnitario": valor_unitario
+            })
         
         # Si no encontramos con el patrón completo, buscar alternativo
         if not lista_lineas:
@@ -485,7 +679,7 @@ def procesar_factura_img(ruta_archivo):
                             "descripcion": limpiar_texto(descripcion),
                             "valorUnitario": valor_unitario
                         })
-                        print(f"    Linea (alt): cant={cantidad}, valor={valor_unitario}")
+                        log.debug("    Linea (alt): cant=%s, valor=%s", cantidad, valor_unitario)
                         break
         
         if not lista_lineas:
@@ -494,41 +688,43 @@ def procesar_factura_img(ruta_archivo):
         # =====================================================================
         # SECCIÓN 4: TOTALES
         # =====================================================================
-        print("\n[SECCION 4] Procesando TOTALES...")
+        log.debug("\n[SECCION 4] Procesando TOTALES...")
+        
+        # Extraer cada monto usando función inteligente (un solo barrido de montos)
+        indice_montos = indexar_montos(texto_completo)
         
-        # Extraer cada monto usando función inteligente
-        venta_gratuita = extraer_monto_inteligente(texto_completo, r"Gratuitas")
-        print(f"    Venta Gratuita: {venta_gratuita}")
+        venta_gratuita = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_GRATUITAS, indice_montos)
+        log.debug("    Venta Gratuita: %s", venta_gratuita)
         
-        subtotal_venta = extraer_monto_inteligente(texto_completo, r"Sub\s*Total\s*Ventas?")
-        print(f"    Subtotal Venta: {subtotal_venta}")
+        subtotal_venta = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_SUBTOTAL, indice_montos)
+        log.debug("    Subtotal Venta: %s", subtotal_venta)
         
-        anticipo = extraer_monto_inteligente(texto_completo, r"Anticipos?")
-        print(f"    Anticipo: {anticipo}")
+        anticipo = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_ANTICIPO, indice_montos)
+        log.debug("    Anticipo: %s", anticipo)
         
-        descuento = extraer_monto_inteligente(texto_completo, r"Descuentos?")
-        print(f"    Descuento: {descuento}")
+        descuento = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_DESCUENTO, indice_montos)
+        log.debug("    Descuento: %s", descuento)
         
-        valor_venta = extraer_monto_inteligente(texto_completo, r"Valor\s*Venta")
-        print(f"    Valor Venta: {valor_venta}")
+        valor_venta = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_VALOR_VENTA, indice_montos)
+        log.debug("    Valor Venta: %s", valor_venta)
         
-        isc = extraer_monto_inteligente(texto_completo, r"ISC(?:\s|$)")
-        print(f"    ISC: {isc}")
+        isc = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_ISC, indice_montos)
+        log.debug("    ISC: %s", isc)
         
-        igv = extraer_monto_inteligente(texto_completo, r"IGV")
-        print(f"    IGV: {igv}")
+        igv = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_IGV, indice_montos)
+        log.debug("    IGV: %s", igv)
         
-        otros_cargos = extraer_monto_inteligente(texto_completo, r"Otros?\s*Cargos?")
-        print(f"    Otros Cargos: {otros_cargos}")
+        otros_cargos = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_OTROS_CARGOS, indice_montos)
+        log.debug("    Otros Cargos: %s", otros_cargos)
         
-        otros_tributos = extraer_monto_inteligente(texto_completo, r"Otros?\s*Tributos?")
-        print(f"    Otros Tributos: {otros_tributos}")
+        otros_tributos = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_OTROS_TRIBUTOS, indice_montos)
+        log.debug("    Otros Tributos: %s", otros_tributos)
         
-        monto_redondeo = extraer_monto_inteligente(texto_completo, r"[Rr]edondeo")
-        print(f"    Monto Redondeo: {monto_redondeo}")
+        monto_redondeo = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_REDONDEO, indice_montos)
+        log.debug("    Monto Redondeo: %s", monto_redondeo)
         
-        importe_total = extraer_monto_inteligente(texto_completo, r"Importe\s*Total")
-        print(f"    Importe Total: {importe_total}")
+        importe_total = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_IMPORTE_TOTAL, indice_montos)
+        log.debug("    Importe Total: %s", importe_total)
         
         # VALIDACIÓN CRUZADA: subtotal debe ser coherente con importe_total
         # Si subtotal > importe_total * 5, probablemente hay error OCR
@@ -537,29 +733,29 @@ def procesar_factura_img(ruta_archivo):
             subtotal_str = str(int(subtotal_venta))
             if len(subtotal_str) > 4 and subtotal_str[0] == subtotal_str[1]:
                 subtotal_corregido = float(subtotal_str[1:])
-                print(f"    [CORRECCION] Subtotal {subtotal_venta} -> {subtotal_corregido}")
+                log.debug("    [CORRECCION] Subtotal %s -> %s", subtotal_venta, subtotal_corregido)
                 subtotal_venta = subtotal_corregido
         
         # Descripción importe total (SON: ...)
         descripcion_importe = ""
-        match_son = re.search(r'SON:\s*(.+?)(?:SOLES|$)', texto_completo, re.IGNORECASE)
+        match_son = _RE_SON.search(texto_lc)
         if match_son:
-            descripcion_importe = limpiar_texto(match_son.group(1))
+            descripcion_importe = limpiar_texto(texto_completo[match_son.start(1):match_son.end(1)])
             if not descripcion_importe.endswith('SOLES'):
                 descripcion_importe += " SOLES"
-            print(f"    Descripcion: {descripcion_importe}")
+            log.debug("    Descripcion: %s", descripcion_importe)
         
         # =====================================================================
         # SECCIÓN 5: CUOTAS
         # =====================================================================
-        print("\n[SECCION 5] Procesando CUOTAS...")
+        log.debug("\n[SECCION 5] Procesando CUOTAS...")
         
-        monto_pendiente = extraer_monto_inteligente(texto_completo, r"pendiente de pago")
-        print(f"    Monto Pendiente: {monto_pendiente}")
+        monto_pendiente = extraer_monto_inteligente(texto_completo, _RE_ETIQUETA_PENDIENTE, indice_montos)
+        log.debug("    Monto Pendiente: %s", monto_pendiente)
         
         # Total de cuotas
         total_cuotas = 0
-        match_total = re.search(r'Total de Cuotas\s*:?\s*(\d+)', texto_completo, re.IGNORECASE)
+        match_total = _RE_TOTAL_CUOTAS.search(texto_lc)
         if match_total:
             total_cuotas = int(match_total.group(1))
         
@@ -581,7 +777,7 @@ def procesar_factura_img(ruta_archivo):
                         "fechaVencimiento": fecha,
                         "monto": monto
                     })
-                    print(f"    Cuota {idx}: {fecha} - {monto}")
+                    log.debug("    Cuota %s: %s - %s", idx, fecha, monto)
                 break
         
         # VALIDACIÓN DE CUOTAS
@@ -606,12 +802,12 @@ def procesar_factura_img(ruta_archivo):
         if total_cuotas == 0:
             total_cuotas = len(lista_cuotas)
         
-        print(f"    Total Cuotas: {total_cuotas}")
+        log.debug("    Total Cuotas: %s", total_cuotas)
         
         # =====================================================================
         # VALIDACIONES FINALES CRUZADAS
         # =====================================================================
-        print("\n[VALIDACIONES] Verificando coherencia...")
+        log.debug("\n[VALIDACIONES] Verificando coherencia...")
         
         # Validar: IGV debe ser ~18% de valor_venta (tolerancia 5%)
         if valor_venta > 0 and igv > 0:
@@ -630,7 +826,7 @@ def procesar_factura_img(ruta_archivo):
         # =====================================================================
         # CONSTRUIR JSON FINAL
         # =====================================================================
-        print("\n[RESULTADO] Construyendo JSON...")
+        log.debug("\n[RESULTADO] Construyendo JSON...")
         
         return {
             "factura": {
@@ -5,12 +5,44 @@ Versión completamente optimizada basada en análisis del output real de EasyOCR
 Sin valores hardcodeados - extracción dinámica inteligente.
 """
 
+import hashlib
+import io
 import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
 import easyocr
 import numpy as np
 from PIL import Image, ImageEnhance
 from catalogos_sunat import convertir_unidad_medida, convertir_moneda
 
+# =============================================================================
+# PATRONES REGEX (COMPILADOS UNA SOLA VEZ)
+# =============================================================================
+_RE_MONTO_SOLES = re.compile(r'[S5]/?\s*([\d,.\s]+)')
+_RE_MONTO_DECIMAL = re.compile(r'[\d,]+\.[\d]{2}')
+_RE_CUOTA = re.compile(r'(\d{2}/\d{2}/\d{4})\s+([\d,.\s]+?)(?=\d{2}/\d{2}/\d{4}|$)')
+
+
+@lru_cache(maxsize=64)
+def _patron_monto_despues_de(despues_de):
+    """Patrón de monto tras una palabra clave (compilado una vez por clave)."""
+    return re.compile(rf'{despues_de}\s*[S5]?/?I?\s*([\d,.\s]+)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=32)
+def _patron_palabras_fin(palabras_fin):
+    """
+    Alternancia literal de las palabras de fin (una búsqueda por línea) y el
+    conjunto de sus primeras letras, para descartar líneas sin ninguna (vacío
+    si hay una palabra vacía, que coincide siempre).
+    """
+    primeras = frozenset(p[0] for p in palabras_fin) if all(palabras_fin) else frozenset()
+    if not palabras_fin:
+        return primeras, re.compile(r'(?!)')  # Sin palabras de fin: nunca corta
+    return primeras, re.compile('|'.join(map(re.escape, palabras_fin)))
+
+
 # =============================================================================
 # INICIALIZACIÓN OCR (SINGLETON)
 # =============================================================================
@@ -49,6 +81,39 @@ def preprocesar_imagen(ruta_imagen):
     return np.array(imagen)
 
 
+_MAX_CACHE_PREPROCESO = 4
+_cache_preproceso = OrderedDict()
+_cache_preproceso_lock = threading.Lock()
+
+
+def preprocesar_imagen_cacheada(ruta_imagen):
+    """
+    preprocesar_imagen memoizada por el contenido del archivo (SHA-1 de sus
+    bytes): los reintentos sobre la misma imagen no vuelven a decodificar ni
+    filtrar. Retorna una copia, para no compartir el arreglo entre llamadas.
+    """
+    try:
+        with open(ruta_imagen, 'rb') as f:
+            datos = f.read()
+    except (OSError, TypeError, ValueError):
+        return preprocesar_imagen(ruta_imagen)
+    
+    huella = hashlib.sha1(datos).hexdigest()
+    with _cache_preproceso_lock:
+        imagen = _cache_preproceso.get(huella)
+        if imagen is not None:
+            _cache_preproceso.move_to_end(huella)
+            return imagen.copy()
+    
+    # Fuera del candado: el preprocesamiento no bloquea a los demás hilos
+    imagen = preprocesar_imagen(io.BytesIO(datos))
+    with _cache_preproceso_lock:
+        _cache_preproceso[huella] = imagen
+        if len(_cache_preproceso) > _MAX_CACHE_PREPROCESO:
+            _cache_preproceso.popitem(last=False)
+    return imagen.copy()
+
+
 # =============================================================================
 # FUNCIONES DE LIMPIEZA Y CONVERSIÓN
 # =============================================================================
@@ -56,41 +121,56 @@ def limpiar_texto(texto):
     """Limpia y normaliza texto."""
     if not texto:
         return ""
-    texto = re.sub(r'\s+', ' ', texto)
-    return texto.strip()
+    return ' '.join(texto.split())
+
 
+# Tabla de limpiar_moneda: borra S, $, / y todo espacio en blanco y corrige
+# O/o/D/d -> 0, I/l -> 1, B -> 8
+_ESPACIOS = ''.join(c for c in map(chr, range(0x3001)) if c.isspace())
+_TABLA_MONEDA = str.maketrans('OoDdIlB', '0000118', 'S$/' + _ESPACIOS)
+# Misma tabla en bytes para el caso habitual de texto ASCII (tabla de 256
+# entradas, sin búsqueda por diccionario)
+_TABLA_MONEDA_ASCII = bytes.maketrans(b'OoDdIlB', b'0000118')
+_BORRAR_MONEDA_ASCII = b'S$/' + bytes(ord(c) for c in _ESPACIOS if c.isascii())
 
+
+@lru_cache(maxsize=512)
 def limpiar_moneda(valor_str):
     """
     Convierte string de moneda a float, manejando errores típicos de OCR.
     Errores comunes: 'O' por '0', 'D' por '0', '5/' por 'S/', separadores.
+    Memoizada: los mismos montos se repiten entre cuotas y totales.
     """
     if not valor_str:
         return 0.0
     
     valor_str = str(valor_str)
     
-    # 1. Remover símbolos de moneda y espacios
-    valor_str = re.sub(r'[S$/Sl\s]', '', valor_str)
+    # Camino rápido: número ya limpio ("1234.56")
+    if valor_str.isascii() and valor_str.replace('.', '', 1).isdigit():
+        return float(valor_str)
+    
+    # 1. Prefijo de moneda "S/" y sus lecturas erradas "Sl"/"SI": la l/I de
+    # ahí es la barra, no un 1
+    valor_str = valor_str.lstrip()
+    if valor_str[:1] == 'S' and valor_str[1:2] in ('/', 'l', 'I'):
+        valor_str = valor_str[2:]
     
-    # 2. Reemplazar errores OCR comunes
-    valor_str = valor_str.replace('O', '0').replace('o', '0')
-    valor_str = valor_str.replace('D', '0').replace('d', '0')
-    valor_str = valor_str.replace('I', '1').replace('l', '1')
-    valor_str = valor_str.replace('B', '8')
+    # 2. Remover símbolos de moneda y espacios, y reemplazar errores OCR
+    # comunes (una sola pasada)
+    if valor_str.isascii():
+        valor_str = valor_str.encode('ascii').translate(_TABLA_MONEDA_ASCII, _BORRAR_MONEDA_ASCII).decode('ascii')
+    else:
+        valor_str = valor_str.translate(_TABLA_MONEDA)
     
-    # 3. Detectar formato y normalizar
+    # 3. Detectar formato y normalizar (un solo conteo de puntos)
     # Caso: "5.200.00" (punto como separador miles)
     if valor_str.count('.') == 2:
         partes = valor_str.split('.')
         valor_str = ''.join(partes[:-1]) + '.' + partes[-1]
     
-    # Caso: "5,200.00" (coma como separador miles)
-    elif ',' in valor_str and '.' in valor_str:
-        valor_str = valor_str.replace(',', '')
-    
-    # Caso: solo coma "5,200"
-    elif ',' in valor_str and '.' not in valor_str:
+    # Caso: "5,200.00" o solo coma "5,200" (coma como separador miles)
+    elif ',' in valor_str:
         valor_str = valor_str.replace(',', '')
     
     try:
@@ -105,32 +185,54 @@ def extraer_texto_easyocr(ruta_imagen):
     Retorna: (texto_completo, lineas_agrupadas, resultados_raw)
     """
     ocr = get_reader()
-    imagen_procesada = preprocesar_imagen(ruta_imagen)
+    imagen_procesada = preprocesar_imagen_cacheada(ruta_imagen)
     resultados = ocr.readtext(imagen_procesada, detail=1, paragraph=False)
+    return agrupar_en_lineas(resultados)
+
+
+def extraer_texto_easyocr_batch(rutas_imagenes, batch_size=8):
+    """
+    Versión por lotes de extraer_texto_easyocr (readtext_batched de EasyOCR).
+    Retorna una tupla (texto_completo, lineas_agrupadas, resultados_raw) por
+    imagen, en el mismo orden de rutas_imagenes.
+    """
+    ocr = get_reader()
+    imagenes = [preprocesar_imagen_cacheada(ruta) for ruta in rutas_imagenes]
     
-    # Ordenar por posición Y, luego X
-    resultados_ordenados = sorted(resultados, key=lambda x: (x[0][0][1], x[0][0][0]))
+    # readtext_batched apila las imágenes de cada llamada: se agrupan por
+    # tamaño para no redimensionarlas (lo que alteraría las coordenadas Y)
+    indices_por_tamano = {}
+    for idx, imagen in enumerate(imagenes):
+        indices_por_tamano.setdefault(imagen.shape, []).append(idx)
     
-    # Agrupar en líneas por coordenada Y similar
-    lineas = []
-    linea_actual = []
-    y_anterior = -100
-    umbral_y = 12
+    salida = [None] * len(imagenes)
+    for indices in indices_por_tamano.values():
+        lote = [imagenes[i] for i in indices]
+        resultados_lote = ocr.readtext_batched(lote, batch_size=batch_size, detail=1, paragraph=False)
+        for idx, resultados in zip(indices, resultados_lote):
+            salida[idx] = agrupar_en_lineas(resultados)
     
-    for bbox, texto, conf in resultados_ordenados:
-        y_actual = bbox[0][1]
-        
-        if y_actual - y_anterior > umbral_y:
-            if linea_actual:
-                lineas.append(' '.join(linea_actual))
-            linea_actual = [texto]
-        else:
-            linea_actual.append(texto)
-        
-        y_anterior = y_actual
+    return salida
+
+
+def agrupar_en_lineas(resultados):
+    """
+    Ordena los resultados de EasyOCR y los agrupa en líneas por coordenada Y.
+    Retorna: (texto_completo, lineas_agrupadas, resultados_ordenados)
+    """
+    # Ordenar por posición Y, luego X (decorar-ordenar-desdecorar: cada esquina
+    # del bbox se lee una sola vez y las Y ordenadas se reutilizan abajo; el
+    # índice desempata sin comparar los resultados y mantiene el orden estable)
+    decorados = sorted((r[0][0][1], r[0][0][0], i) for i, r in enumerate(resultados))
+    resultados_ordenados = [resultados[i] for _, _, i in decorados]
     
-    if linea_actual:
-        lineas.append(' '.join(linea_actual))
+    # Agrupar en líneas por coordenada Y similar: se corta una línea donde el
+    # salto en Y respecto al token anterior supera el umbral (vectorizado)
+    umbral_y = 12
+    textos = [r[1] for r in resultados_ordenados]
+    ys = np.fromiter((y for y, _, _ in decorados), dtype=np.float64, count=len(textos))
+    cortes = [0, *(np.flatnonzero(np.diff(ys) > umbral_y) + 1).tolist(), len(textos)]
+    lineas = [' '.join(textos[ini:fin]) for ini, fin in zip(cortes, cortes[1:]) if fin > ini]
     
     texto_completo = '\n'.join(lineas)
     return texto_completo, lineas, resultados_ordenados
@@ -140,26 +242,30 @@ def extraer_texto_easyocr(ruta_imagen):
 # FUNCIONES DE EXTRACCIÓN ESPECÍFICAS
 # =============================================================================
 
+@lru_cache(maxsize=1024)
 def extraer_monto_de_linea(linea, despues_de=None):
     """
     Extrae un monto de una línea, opcionalmente después de una palabra clave.
     Maneja el formato S/ X,XXX.XX y errores OCR.
+    Memoizada por (linea, despues_de): es una función pura sobre strings.
     """
     if despues_de:
         # Buscar después de la palabra clave
-        match = re.search(rf'{despues_de}\s*[S5]?/?I?\s*([\d,.\s]+)', linea, re.IGNORECASE)
+        match = _patron_monto_despues_de(despues_de).search(linea)
         if match:
             return limpiar_moneda(match.group(1))
     
     # Buscar patrón S/ seguido de monto
-    match = re.search(r'[S5]/?\s*([\d,.\s]+)', linea)
+    match = _RE_MONTO_SOLES.search(linea)
     if match:
         return limpiar_moneda(match.group(1))
     
-    # Buscar cualquier número con decimales
-    numeros = re.findall(r'[\d,]+\.[\d]{2}', linea)
-    if numeros:
-        return limpiar_moneda(numeros[-1])
+    # Buscar cualquier número con decimales (el último, sin armar la lista)
+    match = None
+    for match in _RE_MONTO_DECIMAL.finditer(linea):
+        pass
+    if match:
+        return limpiar_moneda(match.group())
     
     return 0.0
 
@@ -172,18 +278,20 @@ def extraer_cuotas(lineas):
     cuotas = []
     
     for linea in lineas:
-        # Buscar patrón: fecha monto (repetido)
-        patron = r'(\d{2}/\d{2}/\d{4})\s+([\d,.\s]+?)(?=\d{2}/\d{2}/\d{4}|$)'
-        matches = re.findall(patron, linea)
-        
-        for i, (fecha, monto_str) in enumerate(matches, 1):
-            monto = limpiar_moneda(monto_str)
-            if monto > 0:
-                cuotas.append({
-                    "numeroCuota": i,
-                    "fechaVencimientoCuota": fecha,
-                    "montoCuota": monto
-                })
+        # Buscar patrón: fecha monto (repetido); el número de cuota es la
+        # posición en la línea, aunque se descarten montos en cero
+        montos = (
+            (i, fecha, limpiar_moneda(monto_str))
+            for i, (fecha, monto_str) in enumerate(_RE_CUOTA.findall(linea), 1)
+        )
+        cuotas.extend(
+            {
+                "numeroCuota": i,
+                "fechaVencimientoCuota": fecha,
+                "montoCuota": monto
+            }
+            for i, fecha, monto in montos if monto > 0
+        )
     
     return cuotas
 
@@ -191,26 +299,25 @@ def extraer_cuotas(lineas):
 def extraer_direccion_compuesta(lineas, inicio_idx, palabras_fin):
     """
     Extrae una dirección que puede estar en múltiples líneas.
-    Reconstruye la dirección desde inicio_idx hasta encontrar palabras_fin.
+    Reconstruye la dirección desde inicio_idx hasta encontrar palabras_fin;
+    la línea final se corta en la primera palabra de fin que aparece en ella.
     """
     partes = []
+    primeras_fin, patron_fin = _patron_palabras_fin(tuple(palabras_fin))
     
-    for i in range(inicio_idx, min(inicio_idx + 5, len(lineas))):
-        linea = lineas[i]
-        
-        # Verificar si llegamos a una línea que indica fin
-        if any(p in linea for p in palabras_fin):
+    for linea in lineas[inicio_idx:inicio_idx + 5]:
+        # Verificar si llegamos a una línea que indica fin (si no contiene
+        # ninguna letra inicial de las palabras de fin, no hace falta buscar)
+        match_fin = None
+        if not primeras_fin or not primeras_fin.isdisjoint(linea):
+            match_fin = patron_fin.search(linea)
+        if match_fin:
             # Extraer solo la parte relevante
-            for palabra in palabras_fin:
-                if palabra in linea:
-                    idx = linea.index(palabra)
-                    parte = linea[:idx].strip()
-                    if parte:
-                        partes.append(parte)
-                    break
+            parte = linea[:match_fin.start()].strip()
+            if parte:
+                partes.append(parte)
             break
-        else:
-            partes.append(linea.strip())
+        partes.append(linea.strip())
     
     return ' '.join(partes)
 
@@ -5,38 +5,318 @@ Estructura estricta según documentación SUNAT.
 Maneja errores comunes de OCR (S/ confundido con números).
 """
 
+import hashlib
+import io
+import logging
+import os
+import queue
 import re
+import threading
+from collections import OrderedDict, deque
+from functools import lru_cache
 import easyocr
 import numpy as np
 from PIL import Image, ImageEnhance
+try:
+    import cv2  # Viene con EasyOCR (opencv-python-headless)
+except ImportError:
+    cv2 = None
 from catalogos_sunat import convertir_unidad_medida, convertir_moneda
 
+# Trazas de depuración (activar con logging.basicConfig(level=logging.DEBUG))
+log = logging.getLogger(__name__)
+
+# =============================================================================
+# PATRONES REGEX (COMPILADOS UNA SOLA VEZ)
+# =============================================================================
+# Limpieza
+_CARACTERES_MONTO = '0123456789,.'
+# Caracteres que el OCR confunde con dígitos: u/U/D/O/o -> 0, l/I -> 1
+_TABLA_OCR_MONTO = str.maketrans('uUDOolI', '0000011')
+# Símbolo de moneda en una sola sustitución: al inicio "S/", "5/", "sI", "$/",
+# "51"... seguido opcionalmente de "5 " ("5 4,200" -> "4,200"), y cualquier
+# "S/" o "s/" en el resto del texto
+_RE_SIMBOLO_MONEDA = re.compile(r'^(?:[Ss5\$][/lI1]\s*)?(?:[Ss5]\s+)?|[Ss]/\s*')
+# Monto ya limpio sin separador de miles ("4200.00")
+_RE_DECIMAL_LIMPIO = re.compile(r'[0-9]+(?:\.[0-9]+)?')
+
+# Ubigeo y direcciones (XXX-XXX-XXX)
+_RE_UBIGEO = re.compile(r'([A-Za-z\s]+)\s*[-–]\s*([A-Za-z]+)\s*[-–]\s*([A-Za-z]+)')
+_RE_FIN_DIRECCION = re.compile(r'[A-Za-z]+\s*[-–]\s*[A-Za-z]+\s*[-–]\s*[A-Za-z]+')
+
+# Sección 1: cabecera (emisor)
+_RE_RUC = re.compile(r'RUC[:\s]*(\d{11})')
+_RE_NUMERO_FACTURA = re.compile(r'([EF]\d{3}[-–]?\d+)')
+_RE_FACTURA_ELECTRONICA = re.compile(r'^FACTURA\s*ELECTR[OÓ]NICA\s*', re.IGNORECASE)
+_RE_NOMBRE_EMISOR = re.compile(r'^([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑa-záéíóúñ\s]+?)(?=\s+RUC|\s+CAL\.|\s+AV\.|\s+JR\.)')
+_RE_DIRECCION_TRAS_RUC = re.compile(r'RUC[:\s]*\d{11}\s+(.+?)\s+[EF]\d{3}', re.IGNORECASE)
+_RE_DIRECCION_VIA = re.compile(r'((?:CAL\.|AV\.|JR\.)\s*.+?)\s+(?:[EF]\d{3}|ATE|[A-Z]+\s+LIMA)', re.IGNORECASE)
+_RE_UBIGEO_FINAL = re.compile(r'([A-Z][A-Za-z]+)\s*[-–]?\s*(LIMA|[A-Z]{3,})\s*[-–]?\s*(LIMA|[A-Z]{3,})\s*$')
+# Caracteres que puede abarcar _RE_UBIGEO_FINAL (letras, guiones y todo lo que
+# \s acepta, que en Python coincide con str.isspace y está por debajo de U+3001).
+# Como el patrón termina en $, la coincidencia solo puede empezar dentro del
+# sufijo formado por estos caracteres.
+_CARACTERES_UBIGEO = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz-–'
+    + ''.join(c for c in map(chr, range(0x3001)) if c.isspace())
+)
+
+# Sección 2: receptor y cliente
+_RE_FECHA = re.compile(r'(\d{2}/\d{2}/\d{4})')
+_RE_SENOR = re.compile(r'Se.or\(?es\)?:?\s*')
+_RE_RUC_EN_TEXTO = re.compile(r'\s*RUC\s*\d{11}\s*')
+_RE_RUC_RECEPTOR = re.compile(r'RUC\s*:?\s*(\d{11})')
+_RE_CLIENTE = re.compile(r'c.?l.?iente|c.?ll.?ente|cliente')
+_RE_DIRECCION_DEL = re.compile(r'direcci|del\s+c')
+_RE_ANTES_RECEPTOR = re.compile(r'^(.+?)\s*Direcci[oó]n\s+del\s+Receptor', re.IGNORECASE)
+# Prefijos de vía al inicio de una línea (se comparan sobre sus primeros
+# caracteres en mayúsculas, sin regex)
+_PREFIJOS_VIA = ('AV.', 'JR.', 'CAL.')
+_RE_DESPUES_FACTURA = re.compile(r'factura\s+(.+)$', re.IGNORECASE)
+# Palabras que indican que una línea previa al receptor NO es parte de la dirección
+_CLAVES_NO_DIRECCION = ('Fecha', 'RUC', 'Señor', 'EXACTA')
+_RE_ANTES_CLIENTE = re.compile(r'^(.+?)\s*Direcci[oó]n\s+del\s+C.?l+.?ente', re.IGNORECASE)
+_RE_DESPUES_CLIENTE = re.compile(r'C.?l+.?ente\s+(.+)$', re.IGNORECASE)
+_RE_OBSERVACION = re.compile(r'Observaci[oó]n\s*:?\s*(.+)$', re.IGNORECASE)
+_RE_SPOD = re.compile(r'(OPERACI[OÓ]N\s+SUJETA\s+AL\s+SPOD.*?)(?:Cantidad|$)', re.IGNORECASE)
+_RE_CTA_CTE = re.compile(r'(CTA\.?CTE.*)', re.IGNORECASE)
+
+# Sección 3: líneas de factura
+_RE_CABECERA_ITEMS = re.compile(r'Cantldad|Cantidad|Unldad\s+Medlda|Unidad\s+Medida', re.IGNORECASE)
+_RE_UNIDAD_CON_VALOR = re.compile(r'UNIDAD\s+\d{3,}', re.IGNORECASE)
+_RE_CANTIDAD_DECIMAL = re.compile(r'(\d*)\.0[0D]\s*(UNIDAD|NIU)', re.IGNORECASE)
+_RE_PALABRA_CANTIDAD = re.compile(r'Cantidad|Cantldad', re.IGNORECASE)
+_RE_CANTIDAD_SIMPLE = re.compile(r'(\d{1,2})\s+(UNIDAD|NIU)', re.IGNORECASE)
+_RE_MONTO_ITEM = re.compile(r'(\d{1,3}(?:,\d{3})*\.\d{2}|\d{4,}\.\d{2})')
+_RE_DESCRIPCION_ITEM = re.compile(r'UNIDAD\s+(.+?)\s+(\d{1,3}(?:,\d{3})*\.\d{2}|\d{4,}\.\d{2})\s*(.*)$', re.IGNORECASE)
+_RE_CANTIDAD_INICIAL = re.compile(r'^\d{1,2}\s+')
+_RE_ANTES_UNIDAD = re.compile(r'^(.+?)\s+\d*\s*UNIDAD', re.IGNORECASE)
+# Correcciones OCR de la descripción en una sola pasada: '$' leído en lugar de
+# 'S' ("FALABELLA $ A") y 'O' junto a un dígito leída en lugar de '0' (también
+# cubre la placa "BVZ87O")
+_RE_CORRECCION_DESCRIPCION = re.compile(r'\$|O(?=\d)|(?<=\d)O')
+
+# Sección 4: totales (línea compacta)
+# Dígitos mal leídos en la línea compacta: u/U/D -> 0 (cubre también 'uu'/'UU')
+_TABLA_OCR_TOTALES = str.maketrans('uUD', '000')
+_RE_MONTO_OCR = re.compile(r'[\d,]+\.[0-9uUDd]{2}')
+_RE_CINCO_ANTES_MONTO = re.compile(r'\b5\s+(\d)')
+_RE_CINCUENTA_Y_UNO_ANTES_MONTO = re.compile(r'\b51\s+(\d)')
+_RE_SI_MAYUSCULA = re.compile(r'\bSI\s+')
+_RE_SI_MINUSCULA = re.compile(r'\bsI\s+')
+_RE_CINCUENTA_CERO = re.compile(r'\b50\.00\b')
+_RE_QUINIENTOS_SETENTA_CERO = re.compile(r'\b570\.00\b')
+_RE_MONTO_DECIMAL = re.compile(r'[\d,]+\.\d{2}')
+
+# Sección 4: totales por etiqueta. Una sola alternancia recorre la línea y
+# cada grupo con nombre captura el monto de su etiqueta (se despacha por lastgroup)
+_RE_TOTALES = re.compile(
+    r'Gratuitas\s*:?\s*[Ss5]?/?[Il]?\s*(?P<gratuitas>[\d,.]+)|'
+    r'Total\s*Ven[lt]a?s?\s*:?\s*[Ss5]?/?[Il]?\s*(?P<subtotal>[\d,.]+)|'
+    r'Ant[ic]*ipos?\s*:?\s*[Ss5]?[FfI/]?\s*(?P<anticipo>[\d,.]+)|'
+    r'Descuentos?\s*:?\s*[Ss5]?[FfI/]?\s*(?P<descuento>[\d,.]+)|'
+    r'Valor\s*Venta\s*:?\s*[Ss5]?/?[Il]?\s*(?P<valor_venta>[\d,.]+)|'
+    r'ISC\s*:?\s*[Ss5]?/?[Il]?\s*(?P<isc>[\d,.]+)|'
+    r'IGV\s*:?\s*[Ss5]?/?[Il]?\s*(?P<igv>[\d,.]+)|'
+    r'Otros?\s*Cargos?\s*:?\s*[Ss5]?/?[Il]?\s*(?P<otros_cargos>[\d,.]+)|'
+    r'Otros?\s*Tributos?\s*:?\s*[Ss5]?/?[Il]?\s*(?P<otros_tributos>[\d,.]+)|'
+    r'redondeo\s*:?\s*[Ss5]?/?[Il]?\s*(?P<redondeo>[\d,.]+)|'
+    r'Importe\s*Total\s*:?\s*[Ss5]?/?[Il]?\s*(?P<importe_total>[\d,.]+)',
+    re.IGNORECASE,
+)
+_RE_CERO_MAL_LEIDO = re.compile(r'5[FfI/]\s*0\.0[0D]')  # "S/ 0.00" leído como "5F 0.0D"
+_RE_CERO = re.compile(r'0\.0[0D]')
+_RE_SON = re.compile(r'SON:\s*(.+?)(?:\d|$)', re.IGNORECASE)
+_RE_SON_SOLES = re.compile(r'SON:\s*(.+?)(?:\d|SOLES|$)', re.IGNORECASE)
+
+# Sección 5: cuotas
+_RE_MONTO_PENDIENTE = re.compile(r'[Ss5]?/?[Il]?\s*([\d,.]+)')
+_RE_NUMERO = re.compile(r'([\d,.]+)')
+
+
+# Palabras clave de la sección de totales (sobre la línea en mayúsculas): una
+# línea sin ninguna de ellas no dispara ninguna extracción de montos por
+# etiqueta. Una sola búsqueda en C en lugar de una prueba `in` por palabra.
+_RE_CLAVES_TOTALES = re.compile(
+    r'GRATUITAS|SUB|ANT(?:IC|C)IPO|DESCUENTO|VALOR|ISC|IGV|OTROS|REDONDEO|IMPORTE|SON:'
+)
+
+
+# Cualquier dígito (misma clase que \d en los patrones de montos): sin ninguno,
+# lo capturado tras una etiqueta no puede convertirse a monto
+_RE_DIGITO = re.compile(r'\d')
+
+
+# Patrones parametrizados por etiqueta (compilados una vez por etiqueta). La
+# etiqueta se interpola tal cual: los llamadores pueden pasar una expresión
+# regular (p. ej. alternativas de lectura OCR).
+@lru_cache(maxsize=64)
+def _patron_monto_seguro(etiqueta):
+    return re.compile(rf'{etiqueta}\s*[Ss5]?[/lI]?\s*([\d,.]+)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=64)
+def _patrones_monto_en_linea(etiqueta):
+    """(con símbolo de moneda, cualquier número) tras la etiqueta."""
+    return (
+        re.compile(rf'{etiqueta}\s*[:\s]*[Ss5\$]?[/lI]?\s*([\d,.\s]+)', re.IGNORECASE),
+        re.compile(rf'{etiqueta}\s*[:\s]*([\d,.\s]+)', re.IGNORECASE),
+    )
+
+
 # =============================================================================
 # INICIALIZACIÓN OCR (SINGLETON)
 # =============================================================================
 _reader = None
 
+# GPU opcional: OCR_GPU=1 activa CUDA y el autoajuste de cuDNN
+_USAR_GPU = os.environ.get('OCR_GPU', '0') == '1'
+
+# Forma del lote de calentamiento (cuDNN ajusta sus kernels a esta forma)
+_LOTE_CALENTAMIENTO = (8, 1200, 1600, 3)
+
 def get_reader():
     global _reader
     if _reader is None:
-        print("[OCR] Inicializando EasyOCR...")
-        _reader = easyocr.Reader(['es', 'en'], gpu=False)
+        log.debug("[OCR] Inicializando EasyOCR...")
+        # quantize=True es el valor por defecto (INT8 dinámico en CPU); se deja explícito
+        _reader = easyocr.Reader(['es', 'en'], gpu=_USAR_GPU, quantize=True, cudnn_benchmark=_USAR_GPU)
+        if _USAR_GPU:
+            # Primera pasada en vacío: el autoajuste de cuDNN no cae en la primera factura
+            _reader.readtext_batched(np.zeros(_LOTE_CALENTAMIENTO, dtype=np.uint8))
     return _reader
 
 
+def precargar_ocr():
+    """
+    Solo carga el modelo, sin inferencia. Llamarlo antes de crear los workers
+    (p. ej. gunicorn --preload) para que compartan las páginas del modelo ya
+    cargado: una inferencia en el padre deja iniciado el pool de hilos de
+    PyTorch y los hijos pueden bloquearse tras el fork. Con OCR_GPU=1 no hace
+    nada (el contexto CUDA no sobrevive al fork): cada worker carga el suyo.
+    """
+    if not _USAR_GPU:
+        get_reader()
+
+
+def precalentar_ocr():
+    """
+    Carga el modelo (si falta) y ejecuta una inferencia en vacío, para que la
+    primera factura no pague el arranque en frío. Llamarlo en cada worker ya
+    creado (p. ej. hook post_fork de gunicorn o inicializador del pool),
+    nunca en el proceso padre antes del fork.
+    """
+    ocr = get_reader()
+    ocr.readtext(np.zeros((600, 800, 3), dtype=np.uint8))
+    return ocr
+
+
+def _iniciar_worker(hilos):
+    """
+    Inicializador de cada proceso del pool: limita los hilos de PyTorch y
+    precalienta el OCR ya dentro del hijo.
+    """
+    import torch
+    torch.set_num_threads(hilos)
+    precalentar_ocr()
+
+
+# OCR_PRECALENTAR=1 carga el modelo al importar el módulo (antes del fork)
+if os.environ.get('OCR_PRECALENTAR', '0') == '1':
+    precargar_ocr()
+
+
 # =============================================================================
 # PREPROCESAMIENTO DE IMAGEN
 # =============================================================================
+# Lado máximo (px) de la imagen que se entrega a EasyOCR: las fotos de
+# celular (~12 MP) se reducen antes de realzar y detectar texto
+_LADO_MAXIMO = 1600
+
+# Núcleo 3x3 de ImageFilter.SMOOTH (base de ImageEnhance.Sharpness)
+_KERNEL_SUAVIZADO = np.array([[1, 1, 1], [1, 5, 1], [1, 1, 1]], dtype=np.float32) / 13
+
+
+def _realzar_arreglo(arr):
+    """
+    Contraste x1.5 y nitidez x2.0 sobre un arreglo uint8 RGB, con las mismas
+    fórmulas que ImageEnhance (mezcla con el gris medio y con SMOOTH).
+    Modifica `arr` en el sitio.
+    """
+    # Aumentar contraste: 1.5*arr - 0.5*media
+    media = int(cv2.cvtColor(arr, cv2.COLOR_RGB2GRAY).mean() + 0.5)
+    cv2.addWeighted(arr, 1.5, arr, 0, -0.5 * media, dst=arr)
+    
+    # Aumentar nitidez: 2*arr - suavizado
+    suavizado = cv2.filter2D(arr, -1, _KERNEL_SUAVIZADO)
+    cv2.addWeighted(arr, 2.0, suavizado, -1.0, 0, dst=arr)
+    return arr
+
+
 def preprocesar_imagen(ruta_imagen):
-    imagen = Image.open(ruta_imagen)
+    """
+    Decodifica la imagen (ruta, bytes ya leídos u objeto de archivo con
+    .read(), p. ej. BytesIO), reduce las muy grandes y realza contraste y nitidez. Retorna un arreglo uint8 RGB para EasyOCR.
+    """
+    return _preprocesar(ruta_imagen)[0]
+
+
+def _preprocesar(ruta_imagen):
+    """
+    preprocesar_imagen que además retorna la escala aplicada (1.0 si no se
+    redujo), para devolver las cajas de EasyOCR a píxeles de la imagen original.
+    """
+    if isinstance(ruta_imagen, bytes):
+        datos = ruta_imagen
+    elif hasattr(ruta_imagen, 'read'):
+        datos = ruta_imagen.read()
+    else:
+        with open(ruta_imagen, 'rb') as f:
+            datos = f.read()
+    
+    # Decodificar con OpenCV (libjpeg-turbo/libpng con SIMD); PIL solo si
+    # OpenCV no está disponible o no reconoce el formato
+    if cv2 is not None:
+        arr = cv2.imdecode(np.frombuffer(datos, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if arr is not None:
+            cv2.cvtColor(arr, cv2.COLOR_BGR2RGB, dst=arr)
+            alto, ancho = arr.shape[:2]
+            escala = min(1.0, _LADO_MAXIMO / max(ancho, alto))
+            if escala < 1.0:
+                arr = cv2.resize(arr, (int(ancho * escala), int(alto * escala)), interpolation=cv2.INTER_LANCZOS4)
+            return _realzar_arreglo(arr), escala
+    
+    imagen = Image.open(io.BytesIO(datos))
     if imagen.mode != 'RGB':
         imagen = imagen.convert('RGB')
     
-    # Aumentar contraste y nitidez
+    # Reducir imágenes grandes (el costo del realce y del detector crece con los píxeles)
+    ancho, alto = imagen.size
+    escala = min(1.0, _LADO_MAXIMO / max(ancho, alto))
+    if escala < 1.0:
+        imagen = imagen.resize((int(ancho * escala), int(alto * escala)), Image.LANCZOS)
+    
+    # Aumentar contraste y nitidez (OpenCV si está disponible)
+    if cv2 is not None:
+        return _realzar_arreglo(np.array(imagen)), escala
+    
     imagen = ImageEnhance.Contrast(imagen).enhance(1.5)
     imagen = ImageEnhance.Sharpness(imagen).enhance(2.0)
     
-    return np.array(imagen)
+    return np.array(imagen), escala
+
+
+def _a_escala_original(resultados, escala):
+    """
+    Lleva las cajas de EasyOCR de la imagen reducida a píxeles de la original:
+    el umbral de agrupar_en_lineas está pensado para esa escala.
+    """
+    if escala == 1.0:
+        return resultados
+    return [
+        ([[x / escala, y / escala] for x, y in bbox], texto, conf)
+        for bbox, texto, conf in resultados
+    ]
 
 
 # =============================================================================
@@ -46,8 +326,9 @@ def limpiar_texto(texto):
     """Limpia y normaliza texto."""
     if not texto:
         return ""
-    texto = re.sub(r'\s+', ' ', texto)
-    return texto.strip()
+    # split() sin argumentos corta por los mismos espacios que \s y descarta
+    # los extremos: colapsa y recorta en una sola pasada en C
+    return ' '.join(texto.split())
 
 
 def limpiar_monto(valor_str):
@@ -59,37 +340,48 @@ def limpiar_monto(valor_str):
     if not valor_str:
         return 0.0
     
-    valor_str = str(valor_str).strip()
-    
-    # Primero: Corregir errores OCR comunes de caracteres
-    # u/U confundido con 0
-    valor_str = valor_str.replace('uu', '00').replace('UU', '00')
-    valor_str = valor_str.replace('u', '0').replace('U', '0')
-    # D confundido con 0
-    valor_str = valor_str.replace('D', '0')
-    # Otros errores comunes
-    valor_str = valor_str.replace('O', '0').replace('o', '0')
-    valor_str = valor_str.replace('l', '1').replace('I', '1')
-    
-    # Eliminar símbolos de moneda y variantes OCR
-    # S/ puede aparecer como: S/, s/, 5/, sI, SI, $/, 51, 5 al inicio, etc.
-    valor_str = re.sub(r'^[Ss5\$][/lI1]\s*', '', valor_str)
-    valor_str = re.sub(r'^[Ss5]\s+', '', valor_str)  # "5 4,200" -> "4,200"
-    valor_str = re.sub(r'[Ss]/\s*', '', valor_str)
+    return _limpiar_monto(str(valor_str).strip())
+
+
+@lru_cache(maxsize=4096)
+def _limpiar_monto(valor_str):
+    """
+    limpiar_monto sobre el texto ya convertido a str y sin espacios en los
+    extremos. Memoizado: los mismos montos ("0.00", "S/ 4,200.00"...) se
+    repiten entre líneas y entre facturas de un lote.
+    """
+    # Forma más común ("4200.00"): directo a float. Los que empiezan con '5'
+    # siguen el camino completo (el '5' puede ser un "S/" mal leído: "51...")
+    if valor_str[:1] != '5' and _RE_DECIMAL_LIMPIO.fullmatch(valor_str):
+        return float(valor_str)
     
-    # Eliminar espacios
-    valor_str = valor_str.replace(' ', '')
+    # Lo habitual es que el monto ya venga limpio ("4,200.00"): si solo tiene
+    # dígitos, ',' y '.' y no empieza con '5' (posible "S/" mal leído), ninguna
+    # corrección OCR aplica y se pasa directo a los separadores
+    if valor_str[:1] == '5' or valor_str.strip(_CARACTERES_MONTO):
+        # Primero: Corregir errores OCR comunes de caracteres (una sola pasada)
+        valor_str = valor_str.translate(_TABLA_OCR_MONTO)
+        
+        # Eliminar símbolos de moneda y variantes OCR
+        # S/ puede aparecer como: S/, s/, 5/, sI, SI, $/, 51, 5 al inicio, etc.
+        valor_str = _RE_SIMBOLO_MONEDA.sub('', valor_str)
+        
+        # Eliminar espacios
+        valor_str = valor_str.replace(' ', '')
     
     # Manejar separadores de miles y decimales
     # Formato peruano: 4,200.00 o 4.200,00
-    if ',' in valor_str and '.' in valor_str:
+    # (una sola búsqueda por separador; -1 si no aparece)
+    pos_coma = valor_str.find(',')
+    pos_punto = valor_str.find('.')
+    if pos_coma >= 0 and pos_punto >= 0:
         # Si la coma viene antes del punto: 4,200.00 (formato US/Perú)
-        if valor_str.index(',') < valor_str.index('.'):
+        if pos_coma < pos_punto:
             valor_str = valor_str.replace(',', '')
         else:
             # 4.200,00 (formato europeo)
             valor_str = valor_str.replace('.', '').replace(',', '.')
-    elif ',' in valor_str:
+    elif pos_coma >= 0:
         # Solo coma: puede ser separador de miles o decimales
         partes = valor_str.split(',')
         if len(partes[-1]) == 2:  # Probablemente decimal
@@ -97,9 +389,12 @@ def limpiar_monto(valor_str):
         else:
             valor_str = valor_str.replace(',', '')
     
+    # Sin nada tras la limpieza (p. ej. solo "S/"): 0.0 sin pasar por la excepción
+    if not valor_str:
+        return 0.0
     try:
         return float(valor_str)
-    except:
+    except ValueError:
         return 0.0
 
 
@@ -113,7 +408,8 @@ def corregir_monto_ocr(monto, monto_referencia=None, tolerancia=0.5):
     if monto <= 0:
         return monto
     
-    monto_str = str(int(monto)) if monto == int(monto) else str(monto)
+    monto_entero = int(monto)
+    monto_str = str(monto_entero) if monto == monto_entero else str(monto)
     
     # Si tenemos referencia, verificar coherencia
     if monto_referencia and monto_referencia > 0:
@@ -150,13 +446,18 @@ def extraer_monto_seguro(linea, etiqueta, monto_referencia=None):
     """
     Extrae un monto de una línea de forma segura, corrigiendo errores OCR.
     """
+    patron = _patron_monto_seguro(etiqueta)
+    
+    # Línea sin dígitos: 0.0 sin pasar por el regex de la etiqueta
+    if not _RE_DIGITO.search(linea):
+        return 0.0
+    
     # Normalizar la línea
     linea_norm = linea.replace(':', ' ')
     
     # Patrón para buscar el monto después de la etiqueta
     # El OCR puede poner: "S/ 4,200.00" o "sI 4,200.00" o "5/ 4,200.00" o "514,200.00"
-    patron = rf'{etiqueta}\s*[Ss5]?[/lI]?\s*([\d,.]+)'
-    match = re.search(patron, linea_norm, re.IGNORECASE)
+    match = patron.search(linea_norm)
     
     if match:
         monto = limpiar_monto(match.group(1))
@@ -165,33 +466,78 @@ def extraer_monto_seguro(linea, etiqueta, monto_referencia=None):
     return 0.0
 
 
+# Caché de OCR por contenido (SHA-1 de los bytes del archivo): una factura
+# reenviada (reintentos, cargas masivas) no vuelve a pasar por EasyOCR
+_MAX_CACHE_OCR = 64
+_cache_ocr = OrderedDict()
+_cache_ocr_lock = threading.Lock()
+
+
+def _leer_imagen(ruta_imagen):
+    """Lee el archivo y retorna (bytes, huella SHA-1)."""
+    with open(ruta_imagen, 'rb') as f:
+        datos = f.read()
+    return datos, hashlib.sha1(datos).hexdigest()
+
+
+def _ocr_cacheado(huella):
+    """
+    Resultado de agrupar_en_lineas ya calculado para esa huella, o None.
+    Retorna listas nuevas: el llamador puede modificarlas sin tocar la caché.
+    """
+    with _cache_ocr_lock:
+        resultado = _cache_ocr.get(huella)
+        if resultado is None:
+            return None
+        _cache_ocr.move_to_end(huella)
+    texto, lineas, resultados = resultado
+    return texto, list(lineas), list(resultados)
+
+
+def _guardar_ocr(huella, resultado):
+    """Guarda el resultado como tuplas, aparte de las listas del llamador."""
+    texto, lineas, resultados = resultado
+    with _cache_ocr_lock:
+        _cache_ocr[huella] = (texto, tuple(lineas), tuple(resultados))
+        if len(_cache_ocr) > _MAX_CACHE_OCR:
+            _cache_ocr.popitem(last=False)
+
+
 def extraer_texto_easyocr(ruta_imagen):
     """Extrae texto de imagen con EasyOCR."""
+    datos, huella = _leer_imagen(ruta_imagen)
+    resultado = _ocr_cacheado(huella)
+    if resultado is not None:
+        return resultado
+    
     ocr = get_reader()
-    imagen_procesada = preprocesar_imagen(ruta_imagen)
+    imagen_procesada, escala = _preprocesar(datos)
     resultados = ocr.readtext(imagen_procesada, detail=1, paragraph=False)
+    resultado = agrupar_en_lineas(_a_escala_original(resultados, escala))
+    _guardar_ocr(huella, resultado)
+    return resultado
+
+
+def agrupar_en_lineas(resultados):
+    """
+    Agrupa los resultados de EasyOCR en líneas de texto.
+    Retorna (texto_completo, lineas, resultados_ordenados).
+    """
+    # Ordenar por Y, luego X: la esquina superior izquierda de cada bbox se
+    # lee una sola vez y np.lexsort (estable, como sorted) da la permutación
+    n = len(resultados)
+    ys = np.fromiter((r[0][0][1] for r in resultados), dtype=np.float64, count=n)
+    xs = np.fromiter((r[0][0][0] for r in resultados), dtype=np.float64, count=n)
+    orden = np.lexsort((xs, ys))
+    resultados_ordenados = [resultados[i] for i in orden.tolist()]
+    ys = ys[orden]
     
-    # Ordenar por Y, luego X
-    resultados_ordenados = sorted(resultados, key=lambda x: (x[0][0][1], x[0][0][0]))
-    
-    # Agrupar en líneas
-    lineas = []
-    linea_actual = []
-    y_anterior = -100
+    # Agrupar en líneas: se corta una línea donde el salto en Y respecto al
+    # token anterior supera el umbral (vectorizado)
     umbral_y = 15
-    
-    for bbox, texto, conf in resultados_ordenados:
-        y_actual = bbox[0][1]
-        if y_actual - y_anterior > umbral_y:
-            if linea_actual:
-                lineas.append(' '.join(linea_actual))
-            linea_actual = [texto]
-        else:
-            linea_actual.append(texto)
-        y_anterior = y_actual
-    
-    if linea_actual:
-        lineas.append(' '.join(linea_actual))
+    textos = [r[1] for r in resultados_ordenados]
+    cortes = [0, *(np.flatnonzero(np.diff(ys) > umbral_y) + 1).tolist(), len(textos)]
+    lineas = [' '.join(textos[ini:fin]) for ini, fin in zip(cortes, cortes[1:]) if fin > ini]
     
     return '\n'.join(lineas), lineas, resultados_ordenados
 
@@ -200,12 +546,19 @@ def extraer_texto_easyocr(ruta_imagen):
 # FUNCIONES DE EXTRACCIÓN ESPECÍFICAS
 # =============================================================================
 
+def _corregir_caracter_descripcion(match):
+    """'$' -> 'S' y 'O' junto a un dígito -> '0' (ver _RE_CORRECCION_DESCRIPCION)."""
+    return 'S' if match.group() == '$' else '0'
+
+
 def extraer_ubigeo(texto):
     """
     Extrae distrito-provincia-departamento del formato XXX-XXX-XXX.
     """
-    # Buscar patrón con guiones
-    match = re.search(r'([A-Za-z\s]+)\s*[-–]\s*([A-Za-z]+)\s*[-–]\s*([A-Za-z]+)', texto)
+    # Buscar patrón con guiones (sin guion no hay nada que buscar)
+    if '-' not in texto and '–' not in texto:
+        return "", "", ""
+    match = _RE_UBIGEO.search(texto)
     if match:
         return match.group(1).strip(), match.group(2).strip(), match.group(3).strip()
     return "", "", ""
@@ -218,13 +571,15 @@ def extraer_direccion_completa(lineas, inicio_idx, max_lineas=5):
     """
     direccion_partes = []
     idx = inicio_idx
+    fin = min(inicio_idx + max_lineas, len(lineas))
     
-    while idx < min(inicio_idx + max_lineas, len(lineas)):
+    while idx < fin:
         linea = lineas[idx]
         direccion_partes.append(linea)
         
-        # Si encontramos el patrón XXX-XXX-XXX, terminamos
-        if re.search(r'[A-Za-z]+\s*[-–]\s*[A-Za-z]+\s*[-–]\s*[A-Za-z]+', linea):
+        # Si encontramos el patrón XXX-XXX-XXX, terminamos (el regex solo
+        # corre en líneas con algún guion)
+        if ('-' in linea or '–' in linea) and _RE_FIN_DIRECCION.search(linea):
             break
         
         idx += 1
@@ -236,19 +591,23 @@ def buscar_monto_en_linea(linea, etiqueta):
     """
     Busca un monto después de una etiqueta, manejando S/ y errores OCR.
     """
+    patron, patron2 = _patrones_monto_en_linea(etiqueta)
+    
+    # Línea sin dígitos: 0.0 sin pasar por el regex de la etiqueta
+    if not _RE_DIGITO.search(linea):
+        return 0.0
+    
     # Normalizar la línea para búsqueda
     linea_norm = linea.replace(':', ' ')
     
     # Buscar patrón: etiqueta seguida de S/ o similar y número
-    patron = rf'{etiqueta}\s*[:\s]*[Ss5\$]?[/lI]?\s*([\d,.\s]+)'
-    match = re.search(patron, linea_norm, re.IGNORECASE)
+    match = patron.search(linea_norm)
     
     if match:
         return limpiar_monto(match.group(1))
     
     # Alternativa: buscar cualquier número después de la etiqueta
-    patron2 = rf'{etiqueta}\s*[:\s]*([\d,.\s]+)'
-    match2 = re.search(patron2, linea_norm, re.IGNORECASE)
+    match2 = patron2.search(linea_norm)
     if match2:
         return limpiar_monto(match2.group(1))
     
@@ -263,18 +622,146 @@ def procesar_factura_img(ruta_archivo):
     """
     Procesa imagen de factura SUNAT siguiendo estructura estricta.
     """
+    try:
+        texto_completo, lineas, resultados_raw = extraer_texto_easyocr(ruta_archivo)
+    except Exception as e:
+        log.exception("Error procesando imagen")
+        return {"validacion": [f"Error procesando imagen: {str(e)}"]}
+    
+    return procesar_lineas_factura(lineas)
+
+
+def procesar_facturas_batch(rutas, batch_size=8):
+    """
+    Procesa varias facturas pasando el OCR por readtext_batched de EasyOCR.
+    Retorna una respuesta por ruta, en el mismo orden de rutas.
+    """
+    respuestas = [None] * len(rutas)
+    imagenes = {}
+    escalas = {}
+    huellas = {}
+    for idx, ruta in enumerate(rutas):
+        try:
+            datos, huellas[idx] = _leer_imagen(ruta)
+            cacheado = _ocr_cacheado(huellas[idx])
+            if cacheado is not None:
+                respuestas[idx] = procesar_lineas_factura(cacheado[1])
+                continue
+            imagenes[idx], escalas[idx] = _preprocesar(datos)
+        except Exception as e:
+            respuestas[idx] = {"validacion": [f"Error procesando imagen: {str(e)}"]}
+    
+    # readtext_batched apila las imágenes de cada llamada: se agrupan por
+    # tamaño para no redimensionarlas (lo que alteraría las coordenadas Y)
+    indices_por_tamano = {}
+    for idx, imagen in imagenes.items():
+        indices_por_tamano.setdefault(imagen.shape, []).append(idx)
+    
+    ocr = get_reader()
+    for indices in indices_por_tamano.values():
+        lote = [imagenes[i] for i in indices]
+        try:
+            resultados_lote = ocr.readtext_batched(lote, batch_size=batch_size, detail=1, paragraph=False)
+        except Exception as e:
+            for idx in indices:
+                respuestas[idx] = {"validacion": [f"Error procesando imagen: {str(e)}"]}
+            continue
+        for idx, resultados in zip(indices, resultados_lote):
+            resultado = agrupar_en_lineas(_a_escala_original(resultados, escalas[idx]))
+            _guardar_ocr(huellas[idx], resultado)
+            respuestas[idx] = procesar_lineas_factura(resultado[1])
+    
+    return respuestas
+
+
+# Marca de fin de la cola de imágenes en procesar_facturas_pipeline
+_FIN_COLA = object()
+
+
+def _etapa_carga(rutas, cola_imagenes, cola_lineas):
+    """
+    Hilo de carga: lee y preprocesa cada imagen. Las que ya están en la
+    caché de OCR (o fallan al leerse) pasan directo a la cola de líneas.
+    """
+    for idx, ruta in enumerate(rutas):
+        try:
+            datos, huella = _leer_imagen(ruta)
+            cacheado = _ocr_cacheado(huella)
+            if cacheado is not None:
+                cola_lineas.put((idx, cacheado[1]))
+                continue
+            imagen, escala = _preprocesar(datos)
+            cola_imagenes.put((idx, huella, imagen, escala))
+        except Exception as e:
+            cola_lineas.put((idx, e))
+    cola_imagenes.put(_FIN_COLA)
+
+
+def _etapa_ocr(ocr, cola_imagenes, cola_lineas):
+    """Hilo de OCR: reconoce cada imagen preprocesada y la agrupa en líneas."""
+    while True:
+        item = cola_imagenes.get()
+        if item is _FIN_COLA:
+            return
+        idx, huella, imagen, escala = item
+        try:
+            resultados = ocr.readtext(imagen, detail=1, paragraph=False)
+            resultado = agrupar_en_lineas(_a_escala_original(resultados, escala))
+        except Exception as e:
+            cola_lineas.put((idx, e))
+            continue
+        _guardar_ocr(huella, resultado)
+        cola_lineas.put((idx, resultado[1]))
+
+
+def procesar_facturas_pipeline(rutas, tamano_cola=8):
+    """
+    Procesa varias facturas solapando etapas: un hilo lee y preprocesa las
+    imágenes, otro corre EasyOCR y el hilo que llama analiza las líneas a
+    medida que llegan (OpenCV y PyTorch liberan el GIL, así que la carga y
+    el OCR avanzan mientras se analiza la factura anterior).
+    Retorna una respuesta por ruta, en el mismo orden de rutas.
+    """
+    ocr = get_reader()
+    cola_imagenes = queue.Queue(maxsize=tamano_cola)
+    cola_lineas = queue.Queue(maxsize=tamano_cola)
+    hilos = [
+        threading.Thread(target=_etapa_carga, args=(rutas, cola_imagenes, cola_lineas), daemon=True),
+        threading.Thread(target=_etapa_ocr, args=(ocr, cola_imagenes, cola_lineas), daemon=True),
+    ]
+    for hilo in hilos:
+        hilo.start()
+    
+    respuestas = [None] * len(rutas)
+    for _ in range(len(rutas)):
+        idx, lineas = cola_lineas.get()
+        if isinstance(lineas, Exception):
+            respuestas[idx] = {"validacion": [f"Error procesando imagen: {str(lineas)}"]}
+        else:
+            respuestas[idx] = procesar_lineas_factura(lineas)
+    
+    for hilo in hilos:
+        hilo.join()
+    return respuestas
+
+
+def procesar_lineas_factura(lineas):
+    """
+    Extrae los campos de la factura a partir de las líneas OCR ya agrupadas.
+    """
     validaciones = []
     
     try:
-        texto_completo, lineas, resultados_raw = extraer_texto_easyocr(ruta_archivo)
+        texto_completo = '\n'.join(lineas)
         
-        # Debug
-        print("=" * 70)
-        print("TEXTO EXTRAIDO POR EASYOCR:")
-        print("=" * 70)
-        for i, linea in enumerate(lineas):
-            print(f"[{i:02d}] {linea}")
-        print("=" * 70)
+        # Debug (el volcado línea por línea solo si está activo)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("=" * 70)
+            log.debug("TEXTO EXTRAIDO POR EASYOCR:")
+            log.debug("=" * 70)
+            for i, linea in enumerate(lineas):
+                log.debug("[%02d] %s", i, linea)
+            log.debug("=" * 70)
         
         if not lineas:
             return {"validacion": ["No se pudo extraer texto de la imagen"]}
@@ -282,7 +769,7 @@ def procesar_factura_img(ruta_archivo):
         # =====================================================================
         # SECCIÓN 1: CABECERA (EMISOR)
         # =====================================================================
-        print("\n[SECCION 1] Procesando CABECERA (EMISOR)...")
+        log.debug("\n[SECCION 1] Procesando CABECERA (EMISOR)...")
         
         # La primera línea del OCR generalmente contiene varios datos mezclados
         # Necesitamos extraer: razonSocialEmisor, direccionEmisor, RUC, numeroFactura, ubigeo
@@ -291,117 +778,184 @@ def procesar_factura_img(ruta_archivo):
         
         # RUC EMISOR - Buscar patrón RUC: XXXXXXXXXXX (11 dígitos)
         ruc_emisor = 0
-        match_ruc = re.search(r'RUC[:\s]*(\d{11})', texto_completo)
+        match_ruc = _RE_RUC.search(texto_completo) if 'RUC' in texto_completo else None
         if match_ruc:
             ruc_emisor = int(match_ruc.group(1))
-            print(f"    RUC Emisor: {ruc_emisor}")
+            log.debug("    RUC Emisor: %s", ruc_emisor)
         
         # NÚMERO DE FACTURA - Formato E001-XXX o F001-XXX
         numero_factura = ""
-        match_factura = re.search(r'([EF]\d{3}[-–]?\d+)', texto_completo)
+        match_factura = _RE_NUMERO_FACTURA.search(texto_completo)
         if match_factura:
             numero_factura = match_factura.group(1)
             if '-' not in numero_factura and '–' not in numero_factura:
                 numero_factura = numero_factura[:4] + '-' + numero_factura[4:]
             numero_factura = numero_factura.replace('–', '-')
-            print(f"    Numero Factura: {numero_factura}")
+            log.debug("    Numero Factura: %s", numero_factura)
         
         # RAZÓN SOCIAL EMISOR - Está al inicio, antes de RUC
         razon_social_emisor = ""
         # Buscar en primera línea, antes de "RUC" o "CAL." o "AV."
         if primera_linea:
             # Eliminar "FACTURA ELECTRONICA" del inicio si existe
-            texto_limpio = re.sub(r'^FACTURA\s*ELECTR[OÓ]NICA\s*', '', primera_linea, flags=re.IGNORECASE)
+            texto_limpio = _RE_FACTURA_ELECTRONICA.sub('', primera_linea)
             
-            # Extraer nombre hasta antes de RUC o dirección
-            match_nombre = re.search(r'^([A-ZÁÉÍÓÚÑ][A-ZÁÉÍÓÚÑa-záéíóúñ\s]+?)(?=\s+RUC|\s+CAL\.|\s+AV\.|\s+JR\.)', texto_limpio)
+            # Extraer nombre hasta antes de RUC o dirección (el patrón exige
+            # "RUC" o el '.' de CAL./AV./JR. tras el nombre)
+            match_nombre = None
+            if 'RUC' in texto_limpio or '.' in texto_limpio:
+                match_nombre = _RE_NOMBRE_EMISOR.search(texto_limpio)
             if match_nombre:
                 razon_social_emisor = limpiar_texto(match_nombre.group(1))
-            print(f"    Razon Social Emisor: {razon_social_emisor}")
+            log.debug("    Razon Social Emisor: %s", razon_social_emisor)
         
         # DIRECCIÓN EMISOR - Está entre RUC y número de factura, o entre RUC y ubigeo
         direccion_emisor = ""
         # La estructura típica es: "...RUC: 12345678901 CAL. 16 APV... E001-131 ATE LIMA LIMA"
         # Buscar texto entre RUC y el número de factura
-        match_dir = re.search(r'RUC[:\s]*\d{11}\s+(.+?)\s+[EF]\d{3}', primera_linea, re.IGNORECASE)
+        match_dir = _RE_DIRECCION_TRAS_RUC.search(primera_linea)
         if match_dir:
             direccion_emisor = limpiar_texto(match_dir.group(1))
         else:
             # Alternativa: buscar patrón CAL./AV./JR. hasta el ubigeo
-            match_dir2 = re.search(r'((?:CAL\.|AV\.|JR\.)\s*.+?)\s+(?:[EF]\d{3}|ATE|[A-Z]+\s+LIMA)', primera_linea, re.IGNORECASE)
+            match_dir2 = _RE_DIRECCION_VIA.search(primera_linea) if '.' in primera_linea else None
             if match_dir2:
                 direccion_emisor = limpiar_texto(match_dir2.group(1))
         
         if direccion_emisor:
-            print(f"    Direccion Emisor: {direccion_emisor}")
+            log.debug("    Direccion Emisor: %s", direccion_emisor)
         
         # UBIGEO EMISOR - Buscar patrón XXX-XXX-XXX o XXX LIMA LIMA
         distrito_emisor, provincia_emisor, departamento_emisor = "", "", ""
-        # Buscar al final de la primera línea
-        ubigeo_match = re.search(r'([A-Z][A-Za-z]+)\s*[-–]?\s*(LIMA|[A-Z]{3,})\s*[-–]?\s*(LIMA|[A-Z]{3,})\s*$', primera_linea)
+        # Buscar al final de la primera línea: solo en el sufijo de letras/espacios/guiones
+        # (evita reintentar el patrón, con su retroceso, desde cada posición de la línea)
+        inicio_ubigeo = len(primera_linea.rstrip(_CARACTERES_UBIGEO))
+        ubigeo_match = _RE_UBIGEO_FINAL.search(primera_linea, inicio_ubigeo)
         if ubigeo_match:
             distrito_emisor = ubigeo_match.group(1)
             provincia_emisor = ubigeo_match.group(2)
             departamento_emisor = ubigeo_match.group(3)
-            print(f"    Ubigeo: {distrito_emisor}-{provincia_emisor}-{departamento_emisor}")
+            log.debug("    Ubigeo: %s-%s-%s", distrito_emisor, provincia_emisor, departamento_emisor)
         
         # =====================================================================
         # SECCIÓN 2: RECEPTOR Y OPERACIÓN
         # =====================================================================
-        print("\n[SECCION 2] Procesando RECEPTOR Y OPERACION...")
+        log.debug("\n[SECCION 2] Procesando RECEPTOR Y OPERACION...")
+        
+        # RECORRIDO ÚNICO DE LÍNEAS: cada línea se pasa a mayúsculas/minúsculas
+        # una sola vez y se clasifica para las secciones 2 a 5; cada sección
+        # procesa después solo las líneas que le corresponden.
+        linea_fecha = None
+        linea_senor = None
+        linea_moneda = None
+        linea_observacion = None
+        ruc_receptor = 0
+        ruc_receptor_encontrado = False
+        idx_receptor = -1
+        idx_cliente = -1
+        lineas_item = []
+        linea_totales_compacta = None
+        lineas_totales = []
+        lineas_pendiente = []
+        lineas_cuotas = []
+        
+        for i, linea in enumerate(lineas):
+            linea_upper = linea.upper()
+            linea_lower = linea.lower()
+            
+            if linea_fecha is None and 'Fecha' in linea and 'Emisi' in linea:
+                linea_fecha = linea
+            if linea_senor is None and 'Se' in linea and 'or' in linea:  # Señor(es)
+                linea_senor = linea
+            
+            # RUC RECEPTOR - primer RUC de 11 dígitos diferente al emisor
+            if not ruc_receptor_encontrado and 'RUC' in linea:
+                match_ruc = _RE_RUC_RECEPTOR.search(linea)
+                if match_ruc:
+                    ruc_encontrado = int(match_ruc.group(1))
+                    if ruc_encontrado != ruc_emisor:
+                        ruc_receptor = ruc_encontrado
+                        ruc_receptor_encontrado = True
+            
+            # Índices de las líneas de dirección (se queda la última coincidencia)
+            # Buscar "Receptor" y "factura" en la misma línea
+            if 'receptor' in linea_lower and 'factura' in linea_lower:
+                idx_receptor = i
+            # Buscar "Cliente" con variantes OCR (Cllente, Cl1ente, etc.)
+            if _RE_CLIENTE.search(linea_lower):
+                # Puede ser "Dirección del Cliente" o variantes OCR
+                if _RE_DIRECCION_DEL.search(linea_lower):
+                    idx_cliente = i
+            
+            if linea_moneda is None and 'Moneda' in linea:
+                linea_moneda = linea
+            if linea_observacion is None and (
+                'Observaci' in linea or ('SUJETA' in linea_upper and 'SPOD' in linea_upper)
+            ):
+                linea_observacion = linea
+            
+            if 'UNIDAD' in linea_upper or 'NIU' in linea_upper:
+                lineas_item.append(linea)
+            
+            # Línea compacta de totales: múltiples montos (al menos 4 con formato X,XXX.XX o X.XX);
+            # cada monto lleva su propio '.', así que con menos de 4 puntos no hace falta buscar
+            if linea_totales_compacta is None and linea.count('.') >= 4:
+                if len(_RE_MONTO_OCR.findall(linea)) >= 4:
+                    linea_totales_compacta = linea
+            if _RE_CLAVES_TOTALES.search(linea_upper):
+                lineas_totales.append((linea, linea_upper))
+            
+            if 'pendiente' in linea_lower and 'pago' in linea_lower:
+                lineas_pendiente.append(linea)
+            # Línea de cuotas (múltiples fechas: cada una aporta dos '/'); se
+            # guardan las fechas encontradas para no volver a buscarlas
+            if linea.count('/') >= 4:
+                fechas = list(_RE_FECHA.finditer(linea))
+                if len(fechas) >= 2:
+                    lineas_cuotas.append((linea, fechas))
         
-        # FECHA DE EMISIÓN - Buscar en línea que contiene "Fecha de Emisión"
+        # FECHA DE EMISIÓN - línea que contiene "Fecha de Emisión"
         fecha_emision = ""
         forma_pago = "Contado"
         
-        for linea in lineas:
-            if 'Fecha' in linea and 'Emisi' in linea:
-                # Extraer fecha
-                match_fecha = re.search(r'(\d{2}/\d{2}/\d{4})', linea)
-                if match_fecha:
-                    fecha_emision = match_fecha.group(1)
-                
-                # Forma de pago suele estar en la misma línea
-                if 'Cr' in linea and 'dito' in linea:
-                    forma_pago = "Credito"
-                elif 'Contado' in linea:
-                    forma_pago = "Contado"
-                
-                print(f"    Fecha Emision: {fecha_emision}")
-                print(f"    Forma de Pago: {forma_pago}")
-                break
+        if linea_fecha is not None:
+            # Extraer fecha
+            match_fecha = _RE_FECHA.search(linea_fecha)
+            if match_fecha:
+                fecha_emision = match_fecha.group(1)
+            
+            # Forma de pago suele estar en la misma línea
+            if 'Cr' in linea_fecha and 'dito' in linea_fecha:
+                forma_pago = "Credito"
+            elif 'Contado' in linea_fecha:
+                forma_pago = "Contado"
+            
+            log.debug("    Fecha Emision: %s", fecha_emision)
+            log.debug("    Forma de Pago: %s", forma_pago)
         
-        # RAZÓN SOCIAL RECEPTOR - Buscar línea con "Señor(es)"
+        # RAZÓN SOCIAL RECEPTOR - línea con "Señor(es)"
         razon_social_receptor = ""
-        ruc_receptor = 0
         
-        for i, linea in enumerate(lineas):
-            if 'Se' in linea and 'or' in linea:  # Señor(es)
-                # Extraer nombre: puede estar antes y después de "Señor(es)"
-                partes = re.split(r'Se.or\(?es\)?:?\s*', linea, maxsplit=1)
-                nombre_partes = []
-                
-                for parte in partes:
-                    parte = parte.strip()
-                    # Eliminar RUC si está incluido en la parte
-                    parte = re.sub(r'\s*RUC\s*\d{11}\s*', '', parte)
-                    if parte and not re.match(r'^\d{11}$', parte):  # No es RUC
-                        nombre_partes.append(parte)
-                
-                razon_social_receptor = ' '.join(nombre_partes)
-                razon_social_receptor = limpiar_texto(razon_social_receptor)
-                print(f"    Razon Social Receptor: {razon_social_receptor}")
-                break
+        if linea_senor is not None:
+            # Extraer nombre: puede estar antes y después de "Señor(es)"
+            partes = _RE_SENOR.split(linea_senor, maxsplit=1)
+            nombre_partes = []
+            
+            for parte in partes:
+                parte = parte.strip()
+                # Eliminar RUC si está incluido en la parte
+                if 'RUC' in parte:
+                    parte = _RE_RUC_EN_TEXTO.sub('', parte)
+                # No es RUC (11 dígitos exactos; isdecimal es la misma clase que \d)
+                if parte and not (len(parte) == 11 and parte.isdecimal()):
+                    nombre_partes.append(parte)
+            
+            razon_social_receptor = ' '.join(nombre_partes)
+            razon_social_receptor = limpiar_texto(razon_social_receptor)
+            log.debug("    Razon Social Receptor: %s", razon_social_receptor)
         
-        # RUC RECEPTOR - Buscar RUC de 11 dígitos diferente al emisor
-        for linea in lineas:
-            match_ruc = re.search(r'RUC\s*:?\s*(\d{11})', linea)
-            if match_ruc:
-                ruc_encontrado = int(match_ruc.group(1))
-                if ruc_encontrado != ruc_emisor:
-                    ruc_receptor = ruc_encontrado
-                    print(f"    RUC Receptor: {ruc_receptor}")
-                    break
+        if ruc_receptor_encontrado:
+            log.debug("    RUC Receptor: %s", ruc_receptor)
         
         # DIRECCIONES - Estrategia mejorada para OCR
         # Estructura típica OCR:
@@ -414,24 +968,10 @@ def procesar_factura_img(ruta_archivo):
         direccion_receptor_factura = ""
         direccion_cliente = ""
         
-        # Buscar índices de las líneas clave
-        idx_receptor = -1
-        idx_cliente = -1
-        
-        for i, linea in enumerate(lineas):
-            linea_lower = linea.lower()
-            # Buscar "Receptor" y "factura" en la misma línea
-            if 'receptor' in linea_lower and 'factura' in linea_lower:
-                idx_receptor = i
-            # Buscar "Cliente" con variantes OCR (Cllente, Cl1ente, etc.)
-            if re.search(r'c.?l.?iente|c.?ll.?ente|cliente', linea_lower):
-                # Puede ser "Dirección del Cliente" o variantes OCR
-                if re.search(r'direcci|del\s+c', linea_lower):
-                    idx_cliente = i
-        
         # DIRECCIÓN RECEPTOR DE LA FACTURA
         if idx_receptor >= 0:
-            partes_receptor = []
+            # deque: las líneas anteriores se agregan por el inicio sin desplazar la lista
+            partes_receptor = deque()
             
             # La línea del receptor puede tener estructuras variadas:
             # Caso 1: "VERTIENTES MZA H LOTE. 4A Dirección del Receptor de la factura CRUCE DE AVENIDA EL SOL"
@@ -439,25 +979,26 @@ def procesar_factura_img(ruta_archivo):
             linea_receptor = lineas[idx_receptor]
             
             # Parte 1: Texto ANTES de "Dirección del Receptor" (puede incluir AV./JR./CAL. al inicio)
-            match_antes = re.search(r'^(.+?)\s*Direcci[oó]n\s+del\s+Receptor', linea_receptor, re.IGNORECASE)
+            match_antes = _RE_ANTES_RECEPTOR.search(linea_receptor)
             if match_antes:
                 texto_antes = match_antes.group(1).strip()
                 if texto_antes:
                     partes_receptor.append(texto_antes)
             
             # Parte 2: líneas anteriores que empiezan con AV./JR./CAL. (solo si no hay texto_antes con dirección)
-            if not partes_receptor or not re.match(r'^AV\.|^JR\.|^CAL\.', partes_receptor[0], re.IGNORECASE):
+            if not partes_receptor or not partes_receptor[0][:4].upper().startswith(_PREFIJOS_VIA):
                 for j in range(max(0, idx_receptor - 3), idx_receptor):
                     linea_j = lineas[j]
-                    if re.match(r'^AV\.|^JR\.|^CAL\.', linea_j, re.IGNORECASE):
-                        partes_receptor.insert(0, linea_j)  # Insertar al inicio
-                    elif partes_receptor and not any(k in linea_j for k in ['Fecha', 'RUC', 'Señor', 'EXACTA']):
-                        # Continuación de dirección
-                        if len(partes_receptor) > 0:
-                            partes_receptor.insert(1, linea_j)
+                    if linea_j[:4].upper().startswith(_PREFIJOS_VIA):
+                        partes_receptor.appendleft(linea_j)  # Insertar al inicio
+                    elif partes_receptor and not any(k in linea_j for k in _CLAVES_NO_DIRECCION):
+                        # Continuación de dirección: justo después de la primera parte
+                        primera = partes_receptor.popleft()
+                        partes_receptor.appendleft(linea_j)
+                        partes_receptor.appendleft(primera)
             
             # Parte 3: Texto DESPUÉS de "factura" en la línea actual  
-            match_despues = re.search(r'factura\s+(.+)$', linea_receptor, re.IGNORECASE)
+            match_despues = _RE_DESPUES_FACTURA.search(linea_receptor)
             if match_despues:
                 partes_receptor.append(match_despues.group(1))
             
@@ -468,13 +1009,13 @@ def procesar_factura_img(ruta_archivo):
                 # Parar si encontramos dirección cliente, tipo moneda, o nueva dirección AV./JR./CAL.
                 if 'cliente' in linea_lower or 'moneda' in linea_lower:
                     break
-                if re.match(r'^AV\.|^JR\.|^CAL\.', linea_j, re.IGNORECASE):
+                if linea_j[:4].upper().startswith(_PREFIJOS_VIA):
                     break
                 partes_receptor.append(linea_j)
             
             direccion_receptor_factura = ' '.join(partes_receptor)
             direccion_receptor_factura = limpiar_texto(direccion_receptor_factura)
-            print(f"    Direccion Receptor Factura: {direccion_receptor_factura}")
+            log.debug("    Direccion Receptor Factura: %s", direccion_receptor_factura)
         
         # DIRECCIÓN DEL CLIENTE
         if idx_cliente >= 0:
@@ -486,14 +1027,14 @@ def procesar_factura_img(ruta_archivo):
             
             # Parte 1: Texto ANTES de "Dirección del Cliente" (incluye AV./JR./CAL.)
             # Usar regex flexible para variantes OCR: Cliente, Cllente, Cl1ente, etc.
-            match_antes = re.search(r'^(.+?)\s*Direcci[oó]n\s+del\s+C.?l+.?ente', linea_cliente, re.IGNORECASE)
+            match_antes = _RE_ANTES_CLIENTE.search(linea_cliente)
             if match_antes:
                 texto_antes = match_antes.group(1).strip()
                 if texto_antes:
                     partes_cliente.append(texto_antes)
             
             # Parte 2: Texto DESPUÉS de "Cliente/Cllente/etc"
-            match_despues = re.search(r'C.?l+.?ente\s+(.+)$', linea_cliente, re.IGNORECASE)
+            match_despues = _RE_DESPUES_CLIENTE.search(linea_cliente)
             if match_despues:
                 partes_cliente.append(match_despues.group(1))
             
@@ -507,43 +1048,38 @@ def procesar_factura_img(ruta_archivo):
             
             direccion_cliente = ' '.join(partes_cliente)
             direccion_cliente = limpiar_texto(direccion_cliente)
-            print(f"    Direccion Cliente: {direccion_cliente}")
+            log.debug("    Direccion Cliente: %s", direccion_cliente)
         
         # TIPO DE MONEDA
         tipo_moneda = "SOLES"
-        for linea in lineas:
-            if 'Moneda' in linea:
-                if 'DOLAR' in linea.upper():
-                    tipo_moneda = "DOLARES"
-                elif 'SOL' in linea.upper():
-                    tipo_moneda = "SOLES"
-                print(f"    Tipo Moneda: {tipo_moneda}")
-                break
+        if linea_moneda is not None:
+            if 'DOLAR' in linea_moneda.upper():
+                tipo_moneda = "DOLARES"
+            elif 'SOL' in linea_moneda.upper():
+                tipo_moneda = "SOLES"
+            log.debug("    Tipo Moneda: %s", tipo_moneda)
         
         # OBSERVACIÓN - Mejorada para capturar todo el contexto
         observacion = ""
-        for i, linea in enumerate(lineas):
-            # Buscar línea con "Observación"
+        if linea_observacion is not None:
+            linea = linea_observacion
+            # Línea con "Observación": extraer el texto que sigue
             if 'Observaci' in linea:
-                # Extraer texto después de "Observación"
-                match = re.search(r'Observaci[oó]n\s*:?\s*(.+)$', linea, re.IGNORECASE)
+                match = _RE_OBSERVACION.search(linea)
                 if match:
                     observacion = limpiar_texto(match.group(1))
-                print(f"    Observacion: {observacion}")
-                break
-            # También buscar "OPERACIÓN SUJETA AL SPOD" que puede estar junto con observación
-            if 'SUJETA' in linea.upper() and 'SPOD' in linea.upper():
+            # "OPERACIÓN SUJETA AL SPOD" que puede estar junto con observación
+            else:
                 # Extraer todo lo que viene después incluyendo CTA.CTE
-                match_obs = re.search(r'(OPERACI[OÓ]N\s+SUJETA\s+AL\s+SPOD.*?)(?:Cantidad|$)', linea, re.IGNORECASE)
+                match_obs = _RE_SPOD.search(linea)
                 if match_obs:
                     observacion = limpiar_texto(match_obs.group(1))
                 else:
                     # Buscar CTA.CTE o CTACTE en la línea
-                    match_cta = re.search(r'(CTA\.?CTE.*)', linea, re.IGNORECASE)
+                    match_cta = _RE_CTA_CTE.search(linea)
                     if match_cta:
                         observacion = f"OPERACIÓN SUJETA AL SPOD {limpiar_texto(match_cta.group(1))}"
-                print(f"    Observacion: {observacion}")
-                break
+            log.debug("    Observacion: %s", observacion)
         
         # Si encontramos observación pero no tiene "OPERACIÓN SUJETA" y hay CTA.CTE
         if observacion and 'CTA' in observacion.upper() and 'OPERACIÓN' not in observacion.upper():
@@ -552,140 +1088,145 @@ def procesar_factura_img(ruta_archivo):
         # =====================================================================
         # SECCIÓN 3: LÍNEAS DE FACTURA
         # =====================================================================
-        print("\n[SECCION 3] Procesando LINEAS DE FACTURA...")
+        log.debug("\n[SECCION 3] Procesando LINEAS DE FACTURA...")
         lista_lineas = []
         
         # El OCR produce líneas en varios formatos:
         # Formato 1 (separado): [12] 28-11-2025-046 SAGA FALABELLA... .00 UNIDAD 4200.00 PENDIENTE...
         # Formato 2 (junto con cabecera): Cantidad Unidad Medida Descripción Valor Unitario 28-11-2025... UNIDAD 6200.00
         
-        for i, linea in enumerate(lineas):
-            if 'UNIDAD' in linea.upper() or 'NIU' in linea.upper():
-                # Verificar si es línea de cabecera SIN datos
-                es_solo_cabecera = re.search(r'Cantldad|Cantidad|Unldad\s+Medlda|Unidad\s+Medida', linea, re.IGNORECASE)
-                tiene_datos = re.search(r'UNIDAD\s+\d{3,}', linea, re.IGNORECASE)  # UNIDAD seguido de valor
-                
-                # Si es cabecera pero TAMBIÉN tiene datos (formato junto), procesarla
-                if es_solo_cabecera and not tiene_datos:
-                    continue  # Solo ignorar si es cabecera pura sin datos
-                
-                # EXTRAER CANTIDAD
-                cantidad = 0.0
-                
-                # Caso 1: "X.00 UNIDAD" o ".00 UNIDAD" o "X.0D UNIDAD" (OCR lee 0 como D)
-                match_cant = re.search(r'(\d*)\.0[0D]\s*(UNIDAD|NIU)', linea, re.IGNORECASE)
-                if match_cant:
-                    if match_cant.group(1):  # Hay número antes del .00
-                        cant_encontrada = float(match_cant.group(1))
-                        if 1 <= cant_encontrada <= 99:
-                            cantidad = cant_encontrada
-                    else:  # Solo ".00 UNIDAD" sin número
-                        cantidad = 1.0  # Default común
-                
-                # Caso 2: "X UNIDAD" sin .00 (buscar número justo antes de UNIDAD)
-                # PERO solo si no hay cabecera de tabla en la línea
-                if cantidad == 0 and not re.search(r'Cantidad|Cantldad', linea, re.IGNORECASE):
-                    match_simple = re.search(r'(\d{1,2})\s+(UNIDAD|NIU)', linea, re.IGNORECASE)
-                    if match_simple:
-                        cant_encontrada = float(match_simple.group(1))
-                        # Validar que sea una cantidad razonable (no confundir con otros números)
-                        if 1 <= cant_encontrada <= 99:
-                            cantidad = cant_encontrada
-                
-                # Caso especial: Si la línea tiene cabecera y no encontramos cantidad explícita,
-                # intentar inferir del subtotal/valorUnitario
-                if cantidad == 0 and re.search(r'Cantidad|Cantldad', linea, re.IGNORECASE):
-                    # Marcar para inferencia posterior
-                    cantidad = 0.0  # Se inferirá después
-                
-                # EXTRAER VALOR UNITARIO - buscar número con formato monetario
-                # Puede ser: "4200.00" o "4,200.00" después de algún texto
-                valor_unitario = 0.0
-                # Buscar el número que parece ser un valor monetario (X,XXX.XX o XXXX.XX)
-                montos_posibles = re.findall(r'(\d{1,3}(?:,\d{3})*\.\d{2}|\d{4,}\.\d{2})', linea)
-                if montos_posibles:
-                    # Tomar el número más grande que no sea absurdamente alto
-                    for m in montos_posibles:
-                        valor = limpiar_monto(m)
-                        if valor > valor_unitario and valor < 1000000:
-                            valor_unitario = valor
-                
-                # EXTRAER DESCRIPCIÓN - Nueva estrategia
-                descripcion = ""
-                
-                # La descripción puede estar:
-                # CASO 1: Después de "UNIDAD" y antes del valor numérico
-                # Formato: "UNIDAD 28-11-2025-046 SAGA FALABELLA S A LIMA AREQUIPA 90M3 4200.00 PENDIENTE..."
-                # CASO 2: Antes de "UNIDAD" 
-                # Formato: "28-11-2025-046 SAGA FALABELLA 1 UNIDAD 4200.00"
-                
-                # Estrategia: extraer TODO entre UNIDAD y el monto, y TODO después del monto
+        for linea in lineas_item:
+            # Verificar si es línea de cabecera SIN datos
+            es_solo_cabecera = _RE_CABECERA_ITEMS.search(linea)
+            
+            # Si es cabecera pero TAMBIÉN tiene datos (formato junto), procesarla
+            # (UNIDAD seguido de valor; solo hace falta mirarlo en cabeceras)
+            if es_solo_cabecera and not _RE_UNIDAD_CON_VALOR.search(linea):
+                continue  # Solo ignorar si es cabecera pura sin datos
+            
+            # EXTRAER CANTIDAD
+            cantidad = 0.0
+            
+            # Caso 1: "X.00 UNIDAD" o ".00 UNIDAD" o "X.0D UNIDAD" (OCR lee 0 como D)
+            match_cant = _RE_CANTIDAD_DECIMAL.search(linea) if '.0' in linea else None
+            if match_cant:
+                if match_cant.group(1):  # Hay número antes del .00
+                    cant_encontrada = float(match_cant.group(1))
+                    if 1 <= cant_encontrada <= 99:
+                        cantidad = cant_encontrada
+                else:  # Solo ".00 UNIDAD" sin número
+                    cantidad = 1.0  # Default común
+            
+            # ¿La línea menciona "Cantidad"? (se busca una vez, solo si hace falta)
+            menciona_cantidad = cantidad == 0 and _RE_PALABRA_CANTIDAD.search(linea)
+            
+            # Caso 2: "X UNIDAD" sin .00 (buscar número justo antes de UNIDAD)
+            # PERO solo si no hay cabecera de tabla en la línea
+            if cantidad == 0 and not menciona_cantidad:
+                match_simple = _RE_CANTIDAD_SIMPLE.search(linea)
+                if match_simple:
+                    cant_encontrada = float(match_simple.group(1))
+                    # Validar que sea una cantidad razonable (no confundir con otros números)
+                    if 1 <= cant_encontrada <= 99:
+                        cantidad = cant_encontrada
+            
+            # Caso especial: Si la línea tiene cabecera y no encontramos cantidad explícita,
+            # intentar inferir del subtotal/valorUnitario
+            if cantidad == 0 and menciona_cantidad:
+                # Marcar para inferencia posterior
+                cantidad = 0.0  # Se inferirá después
+            
+            # EXTRAER VALOR UNITARIO - buscar número con formato monetario
+            # Puede ser: "4200.00" o "4,200.00" después de algún texto
+            valor_unitario = 0.0
+            # Buscar el número que parece ser un valor monetario (X,XXX.XX o XXXX.XX)
+            # (todo monto lleva '.': sin punto no hay nada que buscar)
+            tiene_punto = '.' in linea
+            montos_posibles = _RE_MONTO_ITEM.findall(linea) if tiene_punto else []
+            if montos_posibles:
+                # Tomar el número más grande que no sea absurdamente alto
+                for m in montos_posibles:
+                    valor = limpiar_monto(m)
+                    if valor > valor_unitario and valor < 1000000:
+                        valor_unitario = valor
+            
+            # EXTRAER DESCRIPCIÓN - Nueva estrategia
+            descripcion = ""
+            
+            # La descripción puede estar:
+            # CASO 1: Después de "UNIDAD" y antes del valor numérico
+            # Formato: "UNIDAD 28-11-2025-046 SAGA FALABELLA S A LIMA AREQUIPA 90M3 4200.00 PENDIENTE..."
+            # CASO 2: Antes de "UNIDAD" 
+            # Formato: "28-11-2025-046 SAGA FALABELLA 1 UNIDAD 4200.00"
+            
+            # Estrategia: extraer TODO entre UNIDAD y el monto, y TODO después del monto
+            
+            # Buscar patrón: UNIDAD (texto) (monto con decimales) (más texto)
+            match_desc = _RE_DESCRIPCION_ITEM.search(linea) if tiene_punto else None
+            
+            if match_desc:
+                parte_antes = match_desc.group(1).strip()
+                parte_despues = match_desc.group(3).strip()
                 
-                # Buscar patrón: UNIDAD (texto) (monto con decimales) (más texto)
-                match_desc = re.search(
-                    r'UNIDAD\s+(.+?)\s+(\d{1,3}(?:,\d{3})*\.\d{2}|\d{4,}\.\d{2})\s*(.*)$',
-                    linea, re.IGNORECASE
-                )
+                # Limpiar parte_antes: quitar números de cantidad al inicio
+                parte_antes = _RE_CANTIDAD_INICIAL.sub('', parte_antes)
                 
-                if match_desc:
-                    parte_antes = match_desc.group(1).strip()
-                    parte_despues = match_desc.group(3).strip()
-                    
-                    # Limpiar parte_antes: quitar números de cantidad al inicio
-                    parte_antes = re.sub(r'^\d{1,2}\s+', '', parte_antes)
-                    
-                    # Combinar partes
-                    if parte_despues:
-                        descripcion = f"{parte_antes} {parte_despues}"
-                    else:
-                        descripcion = parte_antes
+                # Combinar partes
+                if parte_despues:
+                    descripcion = f"{parte_antes} {parte_despues}"
                 else:
-                    # Caso alternativo: descripción antes de UNIDAD
-                    match_antes = re.search(r'^(.+?)\s+\d*\s*UNIDAD', linea, re.IGNORECASE)
-                    if match_antes:
-                        descripcion = match_antes.group(1).strip()
-                    
-                    # Y también después del valor unitario
-                    if valor_unitario > 0:
-                        patron_despues = re.escape(f"{valor_unitario:.2f}".replace('.', r'\.'))
-                        match_despues = re.search(rf'{valor_unitario:.2f}\s+(.+)$'.replace('.', r'\.'), linea)
-                        if match_despues:
-                            parte_despues = match_despues.group(1).strip()
-                            if descripcion:
-                                descripcion = f"{descripcion} {parte_despues}"
-                            else:
-                                descripcion = parte_despues
-                
-                # Limpiar descripción final
-                descripcion = limpiar_texto(descripcion)
-                # Corregir errores comunes OCR
-                descripcion = descripcion.replace('$ A', 'S A')  # "FALABELLA $ A" -> "S A"
-                descripcion = descripcion.replace('$', 'S')  # $ leído en lugar de S
-                descripcion = re.sub(r'\bBVZ87O\b', 'BVZ870', descripcion)  # O->0
-                descripcion = re.sub(r'O(\d)', r'0\1', descripcion)  # O seguido de número -> 0
-                descripcion = re.sub(r'(\d)O', r'\g<1>0', descripcion)  # número seguido de O -> 0
-                
-                # Si cantidad aún es 0, inferir de subtotal/valorUnitario
-                cantidad_inferir = (cantidad == 0)
-                
-                print(f"    Cantidad: {cantidad}")
-                print(f"    Valor Unitario: {valor_unitario}")
-                print(f"    Descripcion: {descripcion}")
+                    descripcion = parte_antes
+            else:
+                # Caso alternativo: descripción antes de UNIDAD
+                match_antes = _RE_ANTES_UNIDAD.search(linea)
+                if match_antes:
+                    descripcion = match_antes.group(1).strip()
                 
-                lista_lineas.append({
-                    "cantidad": cantidad,
-                    "unidadMedida": "UNIDAD",
-                    "descripcion": descripcion,
-                    "valorUnitario": valor_unitario
-                })
-        
+                # Y también después del valor unitario. OJO: se reproduce a
+                # propósito un error del patrón original,
+                #   rf'{monto}\s+(.+)$'.replace('.', r'\.')
+                # que escapaba también el '.' de "(.+)": en vez de tomar el texto
+                # que sigue al monto, solo acepta una cola de puntos al final de
+                # la línea ("150.00 ..."). Corregirlo cambia las descripciones
+                # extraídas y queda para un cambio aparte.
+                if valor_unitario > 0:
+                    cola = linea[:-1] if linea.endswith('\n') else linea  # '$' admite un '\n' final
+                    sin_puntos = cola.rstrip('.')
+                    antes_espacios = sin_puntos.rstrip()
+                    if (sin_puntos != cola and antes_espacios != sin_puntos
+                            and antes_espacios.endswith(f"{valor_unitario:.2f}")):
+                        parte_despues = cola[len(sin_puntos):]
+                        if descripcion:
+                            descripcion = f"{descripcion} {parte_despues}"
+                        else:
+                            descripcion = parte_despues
+            
+            # Limpiar descripción final
+            descripcion = limpiar_texto(descripcion)
+            # Corregir errores comunes OCR
+            descripcion = _RE_CORRECCION_DESCRIPCION.sub(_corregir_caracter_descripcion, descripcion)
+            
+            # Si cantidad aún es 0, inferir de subtotal/valorUnitario
+            cantidad_inferir = (cantidad == 0)
+            
+            log.debug("    Cantidad: %s", cantidad)
+            log.debug("    Valor Unitario: %s", valor_unitario)
+            log.debug("    Descripcion: %s", descripcion)
+            
+            lista_lineas.append({
+                "cantidad": cantidad,
+                "unidadMedida": "UNIDAD",
+                "descripcion": descripcion,
+                "valorUnitario": valor_unitario
+            })
+    
         if not lista_lineas:
             validaciones.append("SECCION 3: No se encontraron lineas de factura")
         
         # =====================================================================
         # SECCIÓN 4: TOTALES
         # =====================================================================
-        print("\n[SECCION 4] Procesando TOTALES...")
+        log.debug("\n[SECCION 4] Procesando TOTALES...")
         
         venta_gratuita = 0.0
         subtotal_venta = 0.0
@@ -704,63 +1245,59 @@ def procesar_factura_img(ruta_archivo):
         # Formato típico: "5 4,2uu.UU SI U.UU 5u.UU 5 4,2uu.Uu 57u.U0 51 756.U0"
         # Que representa: Sub Total | Anticipos | Descuentos | Valor Venta | ISC | IGV
         
-        linea_totales_compacta = None
-        for linea in lineas:
-            # Buscar línea que tenga múltiples montos (al menos 3 números con formato X,XXX.XX o X.XX)
-            montos_en_linea = re.findall(r'[\d,]+\.[0-9uUDd]{2}', linea)
-            if len(montos_en_linea) >= 4:
-                linea_totales_compacta = linea
-                print(f"    [DEBUG] Linea compacta detectada: {linea[:80]}...")
-                break
-        
         if linea_totales_compacta:
+            log.debug("    [DEBUG] Linea compacta detectada: %s...", linea_totales_compacta[:80])
+            
             # Extraer todos los montos de la línea compacta
-            # Primero normalizar la línea
-            linea_norm = linea_totales_compacta
-            linea_norm = linea_norm.replace('uu', '00').replace('UU', '00')
-            linea_norm = linea_norm.replace('u', '0').replace('U', '0')
-            linea_norm = linea_norm.replace('D', '0')
+            # Primero normalizar la línea (u/U/D -> 0 en una sola pasada)
+            linea_norm = linea_totales_compacta.translate(_TABLA_OCR_TOTALES)
             
             # El OCR confunde "S/" con "5" o "51", así que separar patrones como "5 4,200" o "51 756"
             # Normalizar: "5 4,200.00" -> separar el 5, "51 756.00" -> separar el 51
-            linea_norm = re.sub(r'\b5\s+(\d)', r'S/ \1', linea_norm)  # "5 4" -> "S/ 4"
-            linea_norm = re.sub(r'\b51\s+(\d)', r'S/ \1', linea_norm)  # "51 7" -> "S/ 7"
-            linea_norm = re.sub(r'\bSI\s+', 'S/ ', linea_norm)  # "SI 0" -> "S/ 0"
-            linea_norm = re.sub(r'\bsI\s+', 'S/ ', linea_norm)  # "sI 0" -> "S/ 0"
+            linea_norm = _RE_CINCO_ANTES_MONTO.sub(r'S/ \1', linea_norm)  # "5 4" -> "S/ 4"
+            linea_norm = _RE_CINCUENTA_Y_UNO_ANTES_MONTO.sub(r'S/ \1', linea_norm)  # "51 7" -> "S/ 7"
+            linea_norm = _RE_SI_MAYUSCULA.sub('S/ ', linea_norm)  # "SI 0" -> "S/ 0"
+            linea_norm = _RE_SI_MINUSCULA.sub('S/ ', linea_norm)  # "sI 0" -> "S/ 0"
             
             # También corregir "50.00" que probablemente es "S/ 0.00"
-            linea_norm = re.sub(r'\b50\.00\b', 'S/ 0.00', linea_norm)
-            linea_norm = re.sub(r'\b570\.00\b', 'S/ 0.00', linea_norm)  # "570" = "S/ 0" mal leído
+            linea_norm = _RE_CINCUENTA_CERO.sub('S/ 0.00', linea_norm)
+            linea_norm = _RE_QUINIENTOS_SETENTA_CERO.sub('S/ 0.00', linea_norm)  # "570" = "S/ 0" mal leído
             
-            print(f"    [DEBUG] Linea normalizada: {linea_norm[:100]}...")
+            log.debug("    [DEBUG] Linea normalizada: %s...", linea_norm[:100])
             
             # Encontrar todos los montos (después de S/ o sueltos)
-            montos = re.findall(r'[\d,]+\.\d{2}', linea_norm)
-            print(f"    [DEBUG] Montos extraidos: {montos}")
+            montos = _RE_MONTO_DECIMAL.findall(linea_norm)
+            log.debug("    [DEBUG] Montos extraidos: %s", montos)
             
             # Orden típico en factura SUNAT: SubTotal, Anticipos, Descuentos, ValorVenta, ISC, IGV
             montos_limpios = [limpiar_monto(m) for m in montos]
-            print(f"    [DEBUG] Montos limpios: {montos_limpios}")
+            log.debug("    [DEBUG] Montos limpios: %s", montos_limpios)
             
             # Estrategia: Encontrar el valor principal (más alto) y calcular IGV esperado
             if montos_limpios:
+                # Los montos como arreglo (float64, mismos valores que la lista)
+                # para filtrar y buscar sin bucles Python
+                arreglo_montos = np.array(montos_limpios, dtype=np.float64)
+                
                 # Filtrar valores que probablemente son errores (5, 10, 50, 51, etc. de S/ mal leído)
-                valores_significativos = [m for m in montos_limpios if m > 100 or m == 0]
+                valores_significativos = arreglo_montos[(arreglo_montos > 100) | (arreglo_montos == 0)]
                 
-                if valores_significativos:
+                if valores_significativos.size:
                     # El valor más alto es probablemente el subtotal/valor_venta
-                    max_valor = max(valores_significativos)
+                    max_valor = float(valores_significativos.max())
                     subtotal_venta = max_valor
                     valor_venta = max_valor
                     
                     # IGV esperado = 18% del valor venta
                     igv_esperado = max_valor * 0.18
                     
-                    # Buscar un valor cercano al IGV esperado entre los montos
-                    for m in montos_limpios:
-                        if m > 0 and abs(m - igv_esperado) < igv_esperado * 0.15:  # Dentro del 15%
-                            igv = m
-                            break
+                    # Buscar un valor cercano al IGV esperado entre los montos (el
+                    # primero dentro del 15%)
+                    cercanos = np.flatnonzero(
+                        (arreglo_montos > 0) & (np.abs(arreglo_montos - igv_esperado) < igv_esperado * 0.15)
+                    )
+                    if cercanos.size:
+                        igv = montos_limpios[cercanos[0]]
                     
                     # Si no encontramos IGV, calcularlo
                     if igv == 0 and max_valor > 0:
@@ -772,124 +1309,114 @@ def procesar_factura_img(ruta_archivo):
                     # Los demás valores (anticipos, descuentos, ISC, otros) probablemente son 0
                     # (los valores pequeños como 5, 7, 10, 50, 570 son errores de OCR de "S/")
                     
-                    print(f"    [DEBUG] SubTotal/ValorVenta: {subtotal_venta}")
-                    print(f"    [DEBUG] IGV calculado: {igv}")
-                    print(f"    [DEBUG] Importe Total: {importe_total}")
+                    log.debug("    [DEBUG] SubTotal/ValorVenta: %s", subtotal_venta)
+                    log.debug("    [DEBUG] IGV calculado: %s", igv)
+                    log.debug("    [DEBUG] Importe Total: %s", importe_total)
         
-        for linea in lineas:
-            linea_upper = linea.upper()
+        for linea, linea_upper in lineas_totales:
+            # Primer monto de cada etiqueta presente en la línea (un solo barrido)
+            montos_etiqueta = {}
+            for m in _RE_TOTALES.finditer(linea):
+                montos_etiqueta.setdefault(m.lastgroup, m.group(m.lastgroup))
             
             # Venta de Operaciones Gratuitas
             if 'GRATUITAS' in linea_upper:
                 # Buscar monto después de Gratuitas
-                match = re.search(r'Gratuitas\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    venta_gratuita = limpiar_monto(match.group(1))
-                print(f"    Venta Gratuita: {venta_gratuita}")
+                if 'gratuitas' in montos_etiqueta:
+                    venta_gratuita = limpiar_monto(montos_etiqueta['gratuitas'])
+                log.debug("    Venta Gratuita: %s", venta_gratuita)
             
             # Sub Total Ventas - El OCR puede leer "Venlas" o "5/5200" junto
             if 'SUB' in linea_upper and 'TOTAL' in linea_upper:
                 # Patrón mejorado: buscar número después de "Total Ven" con variantes OCR
                 # Puede ser "5/5200.00" o "sI 5,200.00" o "S/ 5200.00"
-                match = re.search(r'Total\s*Ven[lt]a?s?\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    subtotal_venta = limpiar_monto(match.group(1))
-                print(f"    Subtotal Venta: {subtotal_venta}")
+                if 'subtotal' in montos_etiqueta:
+                    subtotal_venta = limpiar_monto(montos_etiqueta['subtotal'])
+                log.debug("    Subtotal Venta: %s", subtotal_venta)
             
             # Anticipos - Cuidado: "Anticipos 5/0.00" se lee como "Anticipos 570.00"
             # También: "Antcipos 5F 0.0D" donde 5F es S/ mal leído
             if 'ANTICIPO' in linea_upper or 'ANTCIPO' in linea_upper:
                 # Buscar el patrón, pero detectar "5F 0" o "5/ 0" como S/ 0.00
-                if re.search(r'5[FfI/]\s*0\.0[0D]', linea):
+                if _RE_CERO_MAL_LEIDO.search(linea):
                     anticipo = 0.0
-                else:
-                    match = re.search(r'Ant[ic]*ipos?\s*:?\s*[Ss5]?[FfI/]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                    if match:
-                        anticipo_raw = limpiar_monto(match.group(1))
-                        # Corregir: si es 70.0 o 570.0, probablemente es S/0.00 mal leído
-                        if anticipo_raw == 70.0 or anticipo_raw == 570.0:
-                            anticipo = 0.0
-                        elif anticipo_raw < 100 and re.search(r'0\.0[0D]', linea):
-                            anticipo = 0.0
-                        else:
-                            anticipo = anticipo_raw
-                print(f"    Anticipo: {anticipo}")
+                elif 'anticipo' in montos_etiqueta:
+                    anticipo_raw = limpiar_monto(montos_etiqueta['anticipo'])
+                    # Corregir: si es 70.0 o 570.0, probablemente es S/0.00 mal leído
+                    if anticipo_raw == 70.0 or anticipo_raw == 570.0:
+                        anticipo = 0.0
+                    elif anticipo_raw < 100 and _RE_CERO.search(linea):
+                        anticipo = 0.0
+                    else:
+                        anticipo = anticipo_raw
+                log.debug("    Anticipo: %s", anticipo)
             
             # Descuentos - "5F 0.0D" donde 5F es S/ mal leído y D es 0 mal leído
             if 'DESCUENTO' in linea_upper:
                 # Detectar patrón "5F 0" o "5/ 0" como S/ 0.00
-                if re.search(r'5[FfI/]\s*0\.0[0D]', linea):
+                if _RE_CERO_MAL_LEIDO.search(linea):
                     descuento = 0.0
-                else:
-                    match = re.search(r'Descuentos?\s*:?\s*[Ss5]?[FfI/]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                    if match:
-                        descuento_raw = limpiar_monto(match.group(1))
-                        # Si el valor es muy pequeño y hay "0.0" en la línea, probablemente es 0
-                        if descuento_raw < 10 and re.search(r'0\.0[0D]', linea):
-                            descuento = 0.0
-                        else:
-                            descuento = descuento_raw
-                print(f"    Descuento: {descuento}")
+                elif 'descuento' in montos_etiqueta:
+                    descuento_raw = limpiar_monto(montos_etiqueta['descuento'])
+                    # Si el valor es muy pequeño y hay "0.0" en la línea, probablemente es 0
+                    if descuento_raw < 10 and _RE_CERO.search(linea):
+                        descuento = 0.0
+                    else:
+                        descuento = descuento_raw
+                log.debug("    Descuento: %s", descuento)
             
             # Valor Venta (solo si no es "Gratuitas" ni "Sub Total")
             if 'VALOR' in linea_upper and 'VENTA' in linea_upper and 'GRATUITAS' not in linea_upper and 'SUB' not in linea_upper:
-                match = re.search(r'Valor\s*Venta\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    valor_venta_raw = limpiar_monto(match.group(1))
+                if 'valor_venta' in montos_etiqueta:
+                    valor_venta_raw = limpiar_monto(montos_etiqueta['valor_venta'])
                     # Corregir: "S/4,200" leído como "514,200" o "14200"
                     # Usar subtotal como referencia (deberían ser iguales o muy cercanos)
                     if subtotal_venta > 0:
                         valor_venta = corregir_monto_ocr(valor_venta_raw, subtotal_venta, tolerancia=0.1)
                     else:
                         valor_venta = corregir_monto_ocr(valor_venta_raw)
-                print(f"    Valor Venta: {valor_venta}")
+                log.debug("    Valor Venta: %s", valor_venta)
             
             # ISC
             if 'ISC' in linea_upper and 'DESC' not in linea_upper:
-                match = re.search(r'ISC\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    isc = limpiar_monto(match.group(1))
+                if 'isc' in montos_etiqueta:
+                    isc = limpiar_monto(montos_etiqueta['isc'])
                 
                 # Descripción del importe (SON: ...)
-                match_son = re.search(r'SON:\s*(.+?)(?:\d|$)', linea, re.IGNORECASE)
+                match_son = _RE_SON.search(linea)
                 if match_son:
                     descripcion_importe = limpiar_texto(match_son.group(1))
-                print(f"    ISC: {isc}")
+                log.debug("    ISC: %s", isc)
             
             # IGV
             if 'IGV' in linea_upper:
                 # Manejar formato "IGV 5/ 756.00" donde 5/ es S/
-                match = re.search(r'IGV\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    igv = limpiar_monto(match.group(1))
-                print(f"    IGV: {igv}")
+                if 'igv' in montos_etiqueta:
+                    igv = limpiar_monto(montos_etiqueta['igv'])
+                log.debug("    IGV: %s", igv)
             
             # Otros Cargos
             if 'OTROS' in linea_upper and 'CARGOS' in linea_upper:
-                match = re.search(r'Otros?\s*Cargos?\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    otros_cargos = limpiar_monto(match.group(1))
-                print(f"    Otros Cargos: {otros_cargos}")
+                if 'otros_cargos' in montos_etiqueta:
+                    otros_cargos = limpiar_monto(montos_etiqueta['otros_cargos'])
+                log.debug("    Otros Cargos: %s", otros_cargos)
             
             # Otros Tributos
             if 'OTROS' in linea_upper and 'TRIBUTOS' in linea_upper:
-                match = re.search(r'Otros?\s*Tributos?\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    otros_tributos = limpiar_monto(match.group(1))
-                print(f"    Otros Tributos: {otros_tributos}")
+                if 'otros_tributos' in montos_etiqueta:
+                    otros_tributos = limpiar_monto(montos_etiqueta['otros_tributos'])
+                log.debug("    Otros Tributos: %s", otros_tributos)
             
             # Monto de redondeo
             if 'REDONDEO' in linea_upper:
-                match = re.search(r'redondeo\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    monto_redondeo = limpiar_monto(match.group(1))
-                print(f"    Monto Redondeo: {monto_redondeo}")
+                if 'redondeo' in montos_etiqueta:
+                    monto_redondeo = limpiar_monto(montos_etiqueta['redondeo'])
+                log.debug("    Monto Redondeo: %s", monto_redondeo)
             
             # Importe Total
             if 'IMPORTE' in linea_upper and 'TOTAL' in linea_upper:
-                match = re.search(r'Importe\s*Total\s*:?\s*[Ss5]?/?[Il]?\s*([\d,.]+)', linea, re.IGNORECASE)
-                if match:
-                    importe_raw = limpiar_monto(match.group(1))
+                if 'importe_total' in montos_etiqueta:
+                    importe_raw = limpiar_monto(montos_etiqueta['importe_total'])
                     # Si es muy bajo (ej: 956 cuando debería ser 4956)
                     # El OCR a veces pierde el primer dígito
                     importe_esperado = valor_venta + igv if valor_venta > 0 else 0
@@ -909,39 +1436,38 @@ def procesar_factura_img(ruta_archivo):
                             importe_total = importe_esperado
                     else:
                         importe_total = importe_raw
-                print(f"    Importe Total: {importe_total}")
+                log.debug("    Importe Total: %s", importe_total)
             
             # Descripción del importe (SON: ...)
             if 'SON:' in linea_upper:
-                match_son = re.search(r'SON:\s*(.+?)(?:\d|SOLES|$)', linea, re.IGNORECASE)
+                match_son = _RE_SON_SOLES.search(linea)
                 if match_son:
                     desc = match_son.group(1).strip()
                     if desc:
                         descripcion_importe = desc
                         if 'SOLES' not in descripcion_importe.upper():
                             descripcion_importe += " SOLES"
-                print(f"    Descripcion Importe: {descripcion_importe}")
+                log.debug("    Descripcion Importe: %s", descripcion_importe)
         
         # VALIDACIÓN CRUZADA FINAL
         # 1. Si importe_total es muy bajo, recalcular
         if importe_total < 100 and valor_venta > 100:
             importe_total = valor_venta + igv
-            print(f"    [CORRECCION] Importe Total recalculado: {importe_total}")
+            log.debug("    [CORRECCION] Importe Total recalculado: %s", importe_total)
         
         # 2. Verificar coherencia: IGV debe ser ~18% del valor_venta
         if valor_venta > 0 and igv > 0:
             igv_esperado = valor_venta * 0.18
-            if abs(igv - igv_esperado) < igv_esperado * 0.05:  # Dentro del 5%
-                # Los valores son coherentes
-                pass
-            else:
+            # Fuera del 5% del esperado (un solo comparador; la tolerancia es
+            # relativa al esperado, no al mayor de ambos como en math.isclose)
+            if abs(igv - igv_esperado) >= igv_esperado * 0.05:
                 validaciones.append(f"ADVERTENCIA: IGV ({igv}) no es ~18% de Valor Venta ({valor_venta})")
         
         # 3. Verificar: importe_total ≈ valor_venta + igv
         if valor_venta > 0 and igv > 0 and importe_total > 0:
             importe_esperado = valor_venta + igv
             if abs(importe_total - importe_esperado) > 10:  # Diferencia mayor a 10
-                print(f"    [CORRECCION] Importe ajustado de {importe_total} a {importe_esperado}")
+                log.debug("    [CORRECCION] Importe ajustado de %s a %s", importe_total, importe_esperado)
                 importe_total = importe_esperado
         
         # 4. Inferir cantidad si no se pudo extraer del OCR
@@ -954,63 +1480,60 @@ def procesar_factura_img(ruta_archivo):
                     cantidad_int = round(cantidad_calc)
                     if abs(cantidad_calc - cantidad_int) < 0.1:
                         linea_fact["cantidad"] = float(cantidad_int)
-                        print(f"    [INFERENCIA] Cantidad calculada: {cantidad_int} (subtotal {subtotal_venta} / valor {linea_fact['valorUnitario']})")
+                        log.debug("    [INFERENCIA] Cantidad calculada: %s (subtotal %s / valor %s)", cantidad_int, subtotal_venta, linea_fact['valorUnitario'])
                     else:
                         # Usar el valor calculado directamente
                         linea_fact["cantidad"] = round(cantidad_calc, 2)
-                        print(f"    [INFERENCIA] Cantidad calculada: {cantidad_calc:.2f}")
+                        log.debug("    [INFERENCIA] Cantidad calculada: %.2f", cantidad_calc)
         
         # =====================================================================
         # SECCIÓN 5: CUOTAS (CRÉDITO)
         # =====================================================================
-        print("\n[SECCION 5] Procesando CUOTAS...")
+        log.debug("\n[SECCION 5] Procesando CUOTAS...")
         
         total_cuotas = 0
         lista_cuotas = []
         monto_pendiente = 0.0
         
-        for linea in lineas:
-            # Monto pendiente de pago
-            if 'pendiente' in linea.lower() and 'pago' in linea.lower():
-                match = re.search(r'[Ss5]?/?[Il]?\s*([\d,.]+)', linea)
-                if match:
-                    monto_pendiente = limpiar_monto(match.group(1))
-                print(f"    Monto Pendiente: {monto_pendiente}")
-            
-            # Línea de cuotas (múltiples fechas)
-            fechas = re.findall(r'\d{2}/\d{2}/\d{4}', linea)
-            if len(fechas) >= 2:
-                # Extraer pares fecha-monto
-                pos_fechas = [(m.start(), m.group()) for m in re.finditer(r'\d{2}/\d{2}/\d{4}', linea)]
+        # Monto pendiente de pago
+        for linea in lineas_pendiente:
+            match = _RE_MONTO_PENDIENTE.search(linea)
+            if match:
+                monto_pendiente = limpiar_monto(match.group(1))
+            log.debug("    Monto Pendiente: %s", monto_pendiente)
+        
+        # Líneas de cuotas (múltiples fechas)
+        for linea, fechas in lineas_cuotas:
+            # Extraer pares fecha-monto: el monto es el primer número entre
+            # una fecha y la siguiente (o el final de la línea)
+            for idx, match_fecha in enumerate(fechas):
+                fecha = match_fecha.group()
+                inicio_monto = match_fecha.end()
+                if idx + 1 < len(fechas):
+                    fin_monto = fechas[idx + 1].start()
+                else:
+                    fin_monto = len(linea)
                 
-                for idx, (pos, fecha) in enumerate(pos_fechas):
-                    inicio_monto = pos + len(fecha)
-                    if idx + 1 < len(pos_fechas):
-                        fin_monto = pos_fechas[idx + 1][0]
-                    else:
-                        fin_monto = len(linea)
-                    
-                    texto_monto = linea[inicio_monto:fin_monto]
-                    match_monto = re.search(r'([\d,.]+)', texto_monto)
-                    if match_monto:
-                        monto = limpiar_monto(match_monto.group(1))
-                        if monto > 0:
-                            lista_cuotas.append({
-                                "numeroCuota": idx + 1,
-                                "fechaVencimientoCuota": fecha,
-                                "montoCuota": monto
-                            })
-                            print(f"    Cuota {idx + 1}: {fecha} - {monto}")
+                match_monto = _RE_NUMERO.search(linea, inicio_monto, fin_monto)
+                if match_monto:
+                    monto = limpiar_monto(match_monto.group(1))
+                    if monto > 0:
+                        lista_cuotas.append({
+                            "numeroCuota": idx + 1,
+                            "fechaVencimientoCuota": fecha,
+                            "montoCuota": monto
+                        })
+                        log.debug("    Cuota %s: %s - %s", idx + 1, fecha, monto)
         
         total_cuotas = len(lista_cuotas)
-        print(f"    Total Cuotas: {total_cuotas}")
+        log.debug("    Total Cuotas: %s", total_cuotas)
         
         # =====================================================================
         # CONSTRUIR RESPUESTA
         # =====================================================================
-        print("\n" + "=" * 70)
-        print("CONSTRUCCION DE RESPUESTA...")
-        print("=" * 70)
+        log.debug("=" * 70)
+        log.debug("CONSTRUCCION DE RESPUESTA...")
+        log.debug("=" * 70)
         
         respuesta = {
             # Sección 1: Cabecera
@@ -1061,8 +1584,7 @@ def procesar_factura_img(ruta_archivo):
         return respuesta
         
     except Exception as e:
-        import traceback
-        traceback.print_exc()
+        log.exception("Error procesando imagen")
         return {"validacion": [f"Error procesando imagen: {str(e)}"]}
 
 
@@ -1073,10 +1595,41 @@ if __name__ == "__main__":
     import json
     import sys
     
+    # En la prueba directa se muestran las trazas de cada sección (solo de este módulo)
+    logging.basicConfig(format='%(message)s')
+    log.setLevel(logging.DEBUG)
+    
     archivo = sys.argv[1] if len(sys.argv) > 1 else "pruebaaa.jpeg"
     print(f"\nProcesando: {archivo}\n")
     
-    resultado = procesar_factura_img(archivo)
+    if os.path.isdir(archivo):
+        # Directorio: una factura por proceso. Con fork (Linux, sin GPU) los
+        # hijos heredan el modelo ya cargado en lugar de cargarlo cada uno.
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        
+        extensiones = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+        rutas = sorted(
+            os.path.join(archivo, nombre) for nombre in os.listdir(archivo)
+            if nombre.lower().endswith(extensiones)
+        )
+        metodo = 'fork' if 'fork' in multiprocessing.get_all_start_methods() else None
+        if metodo:
+            precargar_ocr()
+        # EasyOCR ya usa varios hilos por imagen: la mitad de los núcleos como
+        # procesos, repartiendo los hilos de PyTorch para no sobresuscribir
+        nucleos = os.cpu_count() or 2
+        workers = max(1, nucleos // 2)
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context(metodo),
+            initializer=_iniciar_worker,
+            initargs=(max(1, nucleos // workers),),
+        ) as executor:
+            futuros = [executor.submit(procesar_factura_img, ruta) for ruta in rutas]
+            resultado = {ruta: futuro.result() for ruta, futuro in zip(rutas, futuros)}
+    else:
+        resultado = procesar_factura_img(archivo)
     
     print("\n" + "=" * 70)
     print("RESULTADO FINAL (JSON):")